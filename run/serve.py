@@ -0,0 +1,9 @@
+from scripts.service import serve
+
+
+def main():
+    serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+
+class GroupAggregator:
+    """ Group-wise statistics of many columns over one factorization
+
+    The group key is factorized and sorted once, then every statistic is a
+    segment reduction over the sorted values, and the per-group results are
+    broadcast back to rows with a gather on the group codes.
+    """
+
+    def __init__(self, df, keys):
+        self.keys = list(keys)
+        self.codes, self.n_groups = self._factorize(df, self.keys)
+        self.counts = np.bincount(self.codes, minlength=self.n_groups)
+        self.order_ = None
+        self.starts_ = None
+
+    def aggregate(self, values, func):
+        values = np.asarray(values)
+        if func == "count":
+            if values.dtype.kind == "f":
+                return np.bincount(
+                    self.codes[~np.isnan(values)], minlength=self.n_groups
+                )
+            return self.counts
+        elif func == "size":
+            return self.counts
+        elif func in ["sum", "mean", "std"]:
+            return self._moment(values, func)
+        elif func == "min":
+            return np.fmin.reduceat(values[self.order], self.starts)
+        elif func == "max":
+            return np.fmax.reduceat(values[self.order], self.starts)
+        else:
+            raise ValueError("Not supported aggregation: {}".format(func))
+
+    def transform(self, df, aggregations):
+        """ Row-aligned DataFrame of (column, func, name) aggregations """
+        data = {}
+        for column, func, name in aggregations:
+            values = self._get_values(df, column)
+            data[name] = self.aggregate(values, func)[self.codes]
+        return pd.DataFrame(data, index=df.index)
+
+    @property
+    def order(self):
+        if self.order_ is None:
+            self.order_ = np.argsort(self.codes, kind="stable")
+        return self.order_
+
+    @property
+    def starts(self):
+        if self.starts_ is None:
+            self.starts_ = np.zeros(self.n_groups, dtype=np.int64)
+            np.cumsum(self.counts[:-1], out=self.starts_[1:])
+        return self.starts_
+
+    def _moment(self, values, func):
+        valid = ~np.isnan(values) if values.dtype.kind == "f" else slice(None)
+        codes = self.codes[valid]
+        values_ = values[valid].astype(np.float64)
+        total = np.bincount(codes, weights=values_, minlength=self.n_groups)
+        if func == "sum":
+            return total
+        count = np.bincount(codes, minlength=self.n_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            if func == "mean":
+                return mean.astype(values.dtype) if values.dtype.kind == "f" else mean
+            dev = (values_ - mean[codes]) ** 2
+            var = np.bincount(codes, weights=dev, minlength=self.n_groups)
+            return np.sqrt(var / (count - 1))
+
+    @staticmethod
+    def _get_values(df, column):
+        if column in df.columns:
+            return df[column].values
+        return df.index.get_level_values(column).values
+
+    @classmethod
+    def _factorize(cls, df, keys):
+        codes = None
+        n_groups = 1
+        for key in keys:
+            key_codes, uniques = pd.factorize(cls._get_values(df, key), sort=True)
+            if codes is None:
+                codes = key_codes.astype(np.int64)
+            else:
+                codes = codes * len(uniques) + key_codes
+            n_groups *= len(uniques)
+        if len(keys) > 1:
+            # drop combinations of keys which do not appear
+            codes, uniques = pd.factorize(codes, sort=True)
+            n_groups = len(uniques)
+        return codes.astype(np.int64), n_groups
@@ -0,0 +1,47 @@
+import os
+
+
+class CoreBudget:
+    """ Split a budget of cores among trials, models and feature workers
+
+    Concurrent jobs share the cores instead of each one using all of them,
+    e.g. n_trial_workers trials each train LightGBM on
+    n_cores // n_trial_workers threads.
+    """
+
+    def __init__(
+        self, n_cores=None, n_trial_workers=1, n_feature_workers=None, backend="thread"
+    ):
+        if backend not in ["thread", "process"]:
+            raise ValueError("backend has to be 'thread' or 'process'")
+        self.n_cores = n_cores or os.cpu_count() or 1
+        self.n_trial_workers = max(1, min(n_trial_workers, self.n_cores))
+        self.n_feature_workers = n_feature_workers
+        self.backend = backend
+
+    def get_threads(self, n_jobs=1):
+        """ Threads of each of n_jobs jobs running at the same time """
+        return max(1, self.n_cores // max(1, n_jobs))
+
+    def split(self, n_jobs):
+        """ Budget of each of n_jobs jobs running at the same time """
+        return CoreBudget(
+            self.get_threads(n_jobs),
+            self.n_trial_workers,
+            self.n_feature_workers,
+            self.backend,
+        )
+
+    @property
+    def model_threads(self):
+        return self.get_threads(1)
+
+    @property
+    def trial_threads(self):
+        return self.get_threads(self.n_trial_workers)
+
+    @property
+    def feature_workers(self):
+        if self.n_feature_workers is None:
+            return self.n_cores
+        return max(1, min(self.n_feature_workers, self.n_cores))
@@ -0,0 +1,184 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+class FeatureCache:
+    """ Feature values stored under a hash of what they were computed from
+
+    The key of a feature is a hash of the source of its classes, its
+    parameters and a fingerprint of the index and the columns of the input
+    table it is computed from, so changing any of them makes a new entry
+    instead of serving stale values. A manifest keeps the
+    size and the last access time of each entry, and the least recently used
+    entries are removed when the total size exceeds the budget. Files written
+    elsewhere (e.g. memory-mapped matrices) can be tracked to be evicted
+    the same way.
+    """
+
+    def __init__(self, cache_dir, budget=None):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.manifest = None
+        self.protected = set()
+
+    @staticmethod
+    def get_column_fingerprints(df, columns):
+        """ Hash of the index (under "_index") and of each of the columns of df """
+        h = hashlib.sha1()
+        h.update(repr(list(df.index.names)).encode())
+        h.update(pd.util.hash_pandas_object(df.index).values.tobytes())
+        fingerprints = {"_index": h.hexdigest()}
+        for col in columns:
+            h = hashlib.sha1(f"{col}:{df[col].dtype}".encode())
+            h.update(pd.util.hash_pandas_object(df[col], index=False).values.tobytes())
+            fingerprints[col] = h.hexdigest()
+        return fingerprints
+
+    @staticmethod
+    def get_fingerprint(column_fingerprints, columns):
+        """ Fingerprint of the index and the columns (in any order) """
+        return FeatureCache.get_key(
+            column_fingerprints["_index"],
+            *[f"{col}={column_fingerprints[col]}" for col in sorted(columns)],
+        )
+
+    @staticmethod
+    def get_feature_key(feature, fingerprint):
+        h = hashlib.sha1()
+        for cls in type(feature).__mro__:
+            if cls is object:
+                continue
+            try:
+                h.update(inspect.getsource(cls).encode())
+            except (OSError, TypeError):
+                h.update(cls.__qualname__.encode())
+            for key, val in sorted(vars(cls).items()):
+                # descriptors are repr'd with their address, which changes
+                # every process (their code is in the source hashed above)
+                if key.startswith("_") or callable(val):
+                    continue
+                if isinstance(val, (property, classmethod, staticmethod)):
+                    continue
+                h.update(f"{key}={val!r}".encode())
+        for key, val in sorted(vars(feature).items()):
+            h.update(f"{key}={val!r}".encode())
+        h.update(feature.get_external_fingerprint().encode())
+        h.update(fingerprint.encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def get_key(*parts):
+        return hashlib.sha1("/".join(parts).encode()).hexdigest()
+
+    def has(self, key):
+        entry = self._load_manifest().get(key)
+        return entry is not None and os.path.isfile(self._get_path(key))
+
+    def get(self, key):
+        if not self.has(key):
+            return None
+        values = pd.read_pickle(self._get_path(key))
+        self.touch(key)
+        return values
+
+    def put(self, key, values, name=None, kind=None, base=None, fingerprint=None):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._get_path(key)
+        values.to_pickle(path)
+        self._reload_manifest()[key] = {
+            "name": name,
+            "kind": kind,
+            "base": base,
+            "fingerprint": fingerprint,
+            "size": os.path.getsize(path),
+            "last_access": time.time(),
+        }
+        self.evict()
+        self._save_manifest()
+
+    def track(self, key, paths, name=None, kind=None):
+        """ Evict the given files with the entries of the cache """
+        self._reload_manifest()[key] = {
+            "name": name,
+            "kind": kind,
+            "paths": list(paths),
+            "size": sum(os.path.getsize(path) for path in paths),
+            "last_access": time.time(),
+        }
+        self.evict()
+        self._save_manifest()
+
+    def touch(self, key):
+        """ Mark the entry as used now """
+        entry = self._reload_manifest().get(key)
+        if entry is not None:
+            entry["last_access"] = time.time()
+            self._save_manifest()
+
+    def get_entry(self, key):
+        return self._load_manifest().get(key)
+
+    def find(self, base, kind, exclude=()):
+        """ Most recently used entry of the same base computed on other data """
+        entries = [
+            (entry["last_access"], key)
+            for key, entry in self._load_manifest().items()
+            if entry.get("base") == base
+            and entry.get("kind") == kind
+            and key not in exclude
+            and os.path.isfile(self._get_path(key))
+        ]
+        return max(entries)[1] if entries else None
+
+    def protect(self, keys):
+        """ Keep the given entries while evicting """
+        self.protected = set(keys)
+
+    def evict(self):
+        if self.budget is None:
+            return
+        manifest = self._load_manifest()
+        total = sum(entry["size"] for entry in manifest.values())
+        entries = sorted(manifest.items(), key=lambda item: item[1]["last_access"])
+        for key, entry in entries:
+            if total <= self.budget:
+                break
+            if key in self.protected:
+                continue
+            for path in entry.get("paths", [self._get_path(key)]):
+                if os.path.isfile(path):
+                    os.remove(path)
+            total -= entry["size"]
+            del manifest[key]
+            print(f"evict {entry['name']} ({entry['kind']}) from feature cache")
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _reload_manifest(self):
+        # other instances (or processes) may have changed the manifest since
+        self.manifest = None
+        return self._load_manifest()
+
+    def _load_manifest(self):
+        if self.manifest is None:
+            if os.path.isfile(self.manifest_path):
+                with open(self.manifest_path) as f:
+                    self.manifest = json.load(f)
+            else:
+                self.manifest = {}
+        return self.manifest
+
+    def _save_manifest(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._load_manifest(), f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
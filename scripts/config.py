@@ -1,5 +1,7 @@
+import copy
 import os
 
+from .budget import CoreBudget
 from .param_space import IntParamSpace, UniformParamSpace, LogUniformParamSpace
 
 
@@ -32,6 +34,46 @@ class Config:
         self.pickled_structures_path = os.path.join(
             self.pickled_data_dir, "structures.pkl"
         )
+        self.bond_graph_path = os.path.join(self.pickled_data_dir, "bond_graph.npz")
+
+        # columnar files path
+        self.parquet_dir = os.path.join(self.pickle_dir, "parquet")
+        self.parquet_train_path = os.path.join(self.parquet_dir, "train.parquet")
+        self.parquet_test_path = os.path.join(self.parquet_dir, "test.parquet")
+        self.parquet_structures_path = os.path.join(
+            self.parquet_dir, "structures.parquet"
+        )
+
+        # storage format of preprocessed data: "parquet" or "pickle"
+        self.storage_format = "parquet"
+
+        # number of rows in each row group of parquet files
+        self.row_group_size = 100000
+
+        # number of rows to read from train.csv and test.csv (None means all)
+        self.nrows = None
+
+        # number of rows read at once from csv files
+        self.chunksize = 500000
+
+        # molecule ids to load from parquet files (None means all)
+        self.molecules = None
+
+        # feature cache keyed by the feature definition and the input data
+        self.feature_cache_dir = os.path.join(self.pickle_dir, "feature_cache")
+
+        # maximum total size of the feature cache in bytes (None means no limit)
+        self.feature_cache_budget = 20 * 1024 ** 3
+
+        # whether features of tables grown by new molecules are computed only
+        # for the molecules not in the feature cache yet
+        self.incremental = False
+
+        # dtype schemas of features planned by reduce_mem_usage
+        self.dtype_schema_path = os.path.join(self.pickle_dir, "dtype_schema.json")
+
+        # float type of features: "keep", "float16", "float32" or "float64"
+        self.float_policy = "float32"
 
         # submission file path
         self.submission_path = "../results/submission.csv"
@@ -100,24 +142,78 @@ class Config:
         # target: "scalar_coupling_constant"
         self.target_name = "fc"
 
+        # sub-targets trained in one run by Experiment.run_for_subtargets
+        self.target_names = ["fc", "sd", "pso", "dso"]
+
         # whether save X
         self.save_X = True
 
+        # whether build X as a memory-mapped array shared by folds and workers
+        self.memmap_X = False
+        self.memmap_dir = os.path.join(self.pickle_dir, "memmap")
+
         # whether excute tuning
         self.tuning = False
 
         # number of trials for tuning
         self.n_trials = 1
 
+        # pruner of trials: "median", "successive_halving", "hyperband" or None
+        # (pruner_params are the keyword arguments of each pruner)
+        self.pruner = "median"
+        self.pruner_params = {
+            "median": {"n_startup_trials": 5, "n_warmup_steps": 10},
+            "successive_halving": {},
+            "hyperband": {},
+        }
+
+        # report intermediate scores per boosting "iteration" or per "fold"
+        self.prune_by = "iteration"
+
         # number of splits for data
         self.n_splits = 2
 
+        # whether train on binned lightgbm datasets shared by folds and trials
+        self.binned_dataset = True
+        self.binned_dataset_dir = os.path.join(self.pickle_dir, "lgb_dataset")
+        self.dataset_params = {"max_bin": 255, "feature_pre_filter": False}
+
+        # whether train a model per coupling type, and the number of types
+        # trained at the same time (they share the cores of the budget)
+        self.per_type = False
+        self.n_type_workers = 4
+
         # whether save the predicted values
         self.save = False
 
+        # whether save the fold models to the model registry for later inference
+        self.save_models = False
+        self.model_registry_dir = os.path.join(self.pickle_dir, "model")
+
+        # rows of X_test predicted at a time by all fold models, and the number
+        # of batches predicted at the same time
+        self.predict_batch_size = 100000
+        self.n_predict_workers = 4
+
+        # address of the scoring service, the number of molecules scored
+        # together and the seconds a request waits for other requests
+        self.service_host = "127.0.0.1"
+        self.service_port = 8000
+        self.service_max_batch_size = 64
+        self.service_max_wait = 0.005
+
+        # store of out-of-fold and test predictions, versioned per experiment
+        self.prediction_store_dir = os.path.join(self.pickle_dir, "prediction")
+        self.experiment_name = "baseline"
+
         # study name and storage path of parameters for the best model
         self.study_name = f"lgb_{self.target_name}"
         self.storage_path = f"../database/{self.study_name}.db"
+        self.journal_path = f"../database/{self.study_name}.log"
+
+        # storage of studies: "journal" (append-only file) or "sqlite"
+        # (existing sqlite studies are copied to the journal on first use)
+        self.storage_type = "journal"
 
         # static parameters for model
         self.fixed_params = {
@@ -160,3 +256,48 @@ class Config:
 
         # random seed
         self.seed = 42
+
+        # number of cores used by a run (None means all cores)
+        self.n_cores = None
+
+        # number of trials run at the same time, on "thread" or "process" workers
+        self.n_trial_workers = 4
+        self.trial_backend = "thread"
+
+        # number of processes computing features (None means one per core)
+        self.n_feature_workers = 1
+
+        # budget set explicitly (e.g. the share of the cores of a per-type
+        # model), instead of the one of the fields above
+        self.budget_ = None
+
+    @property
+    def budget(self):
+        """ Cores shared by trials, lightgbm threads and feature workers """
+        if self.budget_ is not None:
+            return self.budget_
+        return CoreBudget(
+            self.n_cores,
+            self.n_trial_workers,
+            self.n_feature_workers,
+            self.trial_backend,
+        )
+
+    @budget.setter
+    def budget(self, budget):
+        self.budget_ = budget
+
+    def for_target(self, target_name):
+        """ Copy of the config for another target """
+        config = self.with_study_name(f"lgb_{target_name}")
+        config.target_name = target_name
+        return config
+
+    def with_study_name(self, study_name):
+        """ Copy of the config storing the study under another name """
+        config = copy.copy(self)
+        config.study_name = study_name
+        database_dir = os.path.dirname(self.storage_path)
+        config.storage_path = os.path.join(database_dir, f"{study_name}.db")
+        config.journal_path = os.path.join(database_dir, f"{study_name}.log")
+        return config
@@ -1,10 +1,11 @@
-import os
-
 from collections import namedtuple
 
+import pandas as pd
+
 from .config import Config
 from .db import LocalFile
-from .utility import reduce_mem_usage
+from .feature import FeatureFactory
+from .graph import BondGraph
 from .preprocess import Preprocessor
 
 
@@ -13,40 +14,47 @@ class DatasetCreator:
         self.config = Config()
 
     def run(self):
-        # load files
         db = LocalFile(self.config)
-        train = db.get_train()
-        test = db.get_test()
-        # dipole_moments = db.get_dipole_moments()
-        # magnetic_shielding_tensors = db.get_magnetic_shielding_tensors()
-        # mulliken_charges = db.get_mulliken_charges()
-        # potential_energy = db.get_potential_energy()
-        scalar_coupling_contributions = db.get_scalar_coupling_contributions()
-        structures = db.get_structures()
-
-        if not os.path.isfile(self.config.pickled_train_path):
-            # reduce memory usage
-            train = reduce_mem_usage(train, "train")
-            test = reduce_mem_usage(test, "test")
-            # dipole_moments = reduce_mem_usage(dipole_moments, "dipole_moment")
-            # magnetic_shielding_tensors = reduce_mem_usage(magnetic_shielding_tensors, "magnetic_shielding_tensors")
-            # mulliken_charges = reduce_mem_usage(mulliken_charges, "mulliken_charges")
-            # potential_energy = reduce_mem_usage(potential_energy, "potential_energy")
-            scalar_coupling_contributions = reduce_mem_usage(
-                scalar_coupling_contributions, "scalar_coupling_contributions"
-            )
-            structures = reduce_mem_usage(structures, "structures")
+
+        # only the columns used by the configured features (and targets)
+        columns = self._get_required_columns()
+        if db.has_preprocessed():
+            molecules = self.config.molecules
+            train = db.get_train(columns=columns, molecules=molecules)
+            test = db.get_test(columns=columns, molecules=molecules)
+            structures = db.get_structures(molecules=molecules)
+            if molecules is None:
+                bonds = db.get_bond_graph()
+            else:
+                # the saved graph refers to rows of the whole structures table
+                bonds = Preprocessor.build_bond_graph(structures)
+        else:
+            # load raw files (preprocessed files of another format or without
+            # the bond graph are not used as raw data)
+            train = db.get_raw_train()
+            test = db.get_raw_test()
+            # dipole_moments = db.get_dipole_moments()
+            # magnetic_shielding_tensors = db.get_magnetic_shielding_tensors()
+            # mulliken_charges = db.get_mulliken_charges()
+            # potential_energy = db.get_potential_energy()
+            scalar_coupling_contributions = db.get_scalar_coupling_contributions()
+            structures = db.get_raw_structures()
 
             # preprocess data
             preprocessor = Preprocessor()
-            train, test, structures = preprocessor.run(
+            train, test, structures, bonds = preprocessor.run(
                 train, test, structures, scalar_coupling_contributions
             )
+            # rows are in the order later runs read them in
+            train = db.sort_by_molecule(train)
+            test = db.sort_by_molecule(test)
 
-            # save preprocessed dataframe to pickle
-            train.to_pickle(self.config.pickled_train_path)
-            test.to_pickle(self.config.pickled_test_path)
-            structures.to_pickle(self.config.pickled_structures_path)
+            # save preprocessed dataframe
+            db.save_preprocessed(train, test, structures, bonds)
+
+        # the same projection whether the data are loaded or preprocessed
+        train = self._project(train, columns)
+        test = self._project(test, columns)
 
         # create dataset
         Dataset = namedtuple(
@@ -59,6 +67,7 @@ class DatasetCreator:
                 # "mulliken_charges",
                 # "potential_energy",
                 "structures",
+                "bonds",
             ],
         )
         dataset = Dataset(
@@ -69,5 +78,64 @@ class DatasetCreator:
             # mulliken_charges.set_index("molecule_name"),
             # potential_energy.set_index("molecule_name"),
             structures.set_index("molecule_name"),
+            bonds,
         )
         return dataset
+
+    def append(self, train, test, structures, scalar_coupling_contributions):
+        """ Preprocess new molecules only and append them to the saved data
+
+        The tables are read with the schemas of raw csv files, and molecules
+        which are already preprocessed are skipped.
+        """
+        db = LocalFile(self.config)
+        if not db.has_preprocessed():
+            raise ValueError("No preprocessed data to append new molecules to")
+
+        old_structures = db.get_structures()
+        known = old_structures["molecule_name"].unique()
+        train, test, structures, scalar_coupling_contributions = [
+            df[~df["molecule_name"].isin(known)]
+            for df in [train, test, structures, scalar_coupling_contributions]
+        ]
+        n_molecules = structures["molecule_name"].nunique()
+        if n_molecules == 0:
+            print("no new molecules to append")
+            return
+
+        # preprocess data of new molecules
+        preprocessor = Preprocessor()
+        train, test, structures, bonds = preprocessor.run(
+            train, test, structures, scalar_coupling_contributions
+        )
+
+        structures = pd.concat([old_structures, structures], ignore_index=True)
+        if structures["molecule_name"].is_monotonic_increasing:
+            bonds = BondGraph.concat([db.get_bond_graph(), bonds])
+        else:
+            # new molecules between old ones move the rows of the graph
+            structures = structures.sort_values(
+                ["molecule_name", "atom_index"], kind="mergesort"
+            ).reset_index(drop=True)
+            bonds = Preprocessor.build_bond_graph(structures)
+        train = db.sort_by_molecule(pd.concat([db.get_train(), train]))
+        test = db.sort_by_molecule(pd.concat([db.get_test(), test]))
+
+        # save preprocessed dataframe
+        db.save_preprocessed(train, test, structures, bonds)
+        print(f"append {n_molecules} molecules to preprocessed data")
+
+    @staticmethod
+    def _project(df, columns):
+        return df[[col for col in columns if col in df.columns]]
+
+    def _get_required_columns(self):
+        ff = FeatureFactory()
+        # ids match predictions of test pairs to the rows of the submission
+        columns = ["id", "type", self.config.target_name]
+        for col in self.config.target_names + ff.required_columns(
+            self.config.feature_names
+        ):
+            if col not in columns:
+                columns.append(col)
+        return columns
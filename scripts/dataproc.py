@@ -3,62 +3,248 @@ import os
 import pandas as pd
 from tqdm import tqdm
 
-from .utility import reduce_mem_usage
+from .cache import FeatureCache
+from .utility import reduce_mem_usage, DtypeSchemaStore
 from .feature import FeatureFactory
+from .matrix import FeatureMatrixBuilder, MemmapMatrix
+from .scheduler import FeatureScheduler
+from .incremental import (
+    INDEX_DIGEST,
+    get_molecules,
+    get_molecule_digest,
+    get_digest_columns,
+    get_reusable_molecules,
+)
 
 
 class DataProcessor:
     def __init__(self, config):
         self.config = config
-        self.pickled_feature_dir = config.pickled_feature_dir
         self.feature_names = config.feature_names
         self.target_name = config.target_name
+        self.target_names = config.target_names
         self.save = config.save_X
+        self.float_policy = config.float_policy
+        self.dtype_store = DtypeSchemaStore(config.dtype_schema_path)
+        self.cache = FeatureCache(config.feature_cache_dir, config.feature_cache_budget)
+        self.n_workers = config.budget.feature_workers
+        self.memmap_X = config.memmap_X
+        self.memmap_dir = config.memmap_dir
+        self.incremental = config.incremental
 
     def run(self, dataset):
         # X
         X_train = self._make_X(dataset.train, dataset, "train")
         X_test = self._make_X(dataset.test, dataset, "test")
 
-        # y
-        y_train = dataset.train[["type", self.target_name]]
+        # y (with every sub-target so that they can share X)
+        columns = ["type", self.target_name]
+        columns += [
+            col
+            for col in self.target_names
+            if col not in columns and col in dataset.train.columns
+        ]
+        y_train = dataset.train[columns]
 
         return X_train, y_train, X_test
 
-    def _make_X(self, df, dataset, kind):
-        path = os.path.join(self.pickled_feature_dir, f"{kind}", "X.pkl")
-        if os.path.isfile(path):
-            return self.load_feature(path)
+    def run_for_test(self, dataset):
+        """ X of test only, for predictions by registered models """
+        return self._make_X(dataset.test, dataset, "test")
 
+    def _make_X(self, df, dataset, kind):
         ff = FeatureFactory()
         features = [ff(name) for name in self.feature_names]
 
-        X = pd.DataFrame(index=df.index)
-        index_names = X.index.names
-        for feature in tqdm(features):
+        # cache keys change with the features and the columns they are computed
+        # from, so other columns (e.g. labels) do not invalidate them
+        columns = {f.__class__.__name__: get_digest_columns(f, df) for f in features}
+        used_columns = sorted(set().union(*columns.values()))
+        column_fingerprints = self.cache.get_column_fingerprints(df, used_columns)
+        fingerprints = {
+            _name: self.cache.get_fingerprint(column_fingerprints, cols)
+            for _name, cols in columns.items()
+        }
+        keys = {
+            f.__class__.__name__: self.cache.get_feature_key(
+                f, fingerprints[f.__class__.__name__]
+            )
+            for f in features
+        }
+        # keys without the input data, shared by versions of the same feature
+        bases = {
+            f.__class__.__name__: self.cache.get_feature_key(f, "") for f in features
+        }
+        X_key = self.cache.get_key(kind, *keys.values())
+        digest_keys = {
+            _name: self.cache.get_key("digest", kind, fingerprint)
+            for _name, fingerprint in fingerprints.items()
+        }
+        memmap_key = self.cache.get_key("memmap", X_key)
+        self.cache.protect(
+            list(keys.values()) + list(digest_keys.values()) + [X_key, memmap_key]
+        )
+        digest = None
+        if self.incremental is True and not all(
+            self.cache.has(key) for key in digest_keys.values()
+        ):
+            # rows of each molecule, compared by later runs on grown tables
+            digest = get_molecule_digest(df[used_columns])
+            for _name, key in digest_keys.items():
+                if not self.cache.has(key):
+                    values = digest[[INDEX_DIGEST] + columns[_name]]
+                    self.cache.put(key, values, "digest", kind)
+        memmap = None
+        if self.memmap_X is True:
+            memmap = MemmapMatrix(os.path.join(self.memmap_dir, kind, X_key))
+            if memmap.exists():
+                print(f"load memory-mapped X for {kind}")
+                self.cache.touch(memmap_key)
+                X = memmap.load()
+                X.attrs["cache_key"] = X_key
+                return X
+        else:
+            X = self.cache.get(X_key)
+            if X is not None:
+                print(f"load X for {kind} from feature cache")
+                X.attrs["cache_key"] = X_key
+                return X
+
+        # allocate the whole matrix before computing any feature
+        builder = FeatureMatrixBuilder(df.index, memmap=memmap)
+        builder.allocate(
+            [(f.__class__.__name__, f.get_column_names(df)) for f in features]
+        )
+
+        # compute features not cached yet, sharing group keys where possible
+        pending = []
+        for feature in features:
+            _name = feature.__class__.__name__
+            if self.cache.has(keys[_name]):
+                continue
+            if not feature.is_ready(df, kind):
+                raise RuntimeError(
+                    f"{_name} for {kind} is not ready; run the stage it depends on"
+                )
+            pending.append(feature)
+        scheduler = FeatureScheduler(self.n_workers)
+        computed = set()
+        if self.incremental is True and pending:
+            if digest is None:
+                digest = get_molecule_digest(df[used_columns])
+            pending, results = self._make_incremental(
+                pending, df, dataset, kind, digest, bases
+            )
+            for _name, values in self._store_feature(
+                results, keys, kind, bases, fingerprints
+            ).items():
+                builder.write(_name, values)
+                computed.add(_name)
+            del results
+        units = ff.fuse(pending)
+        for results in tqdm(scheduler.run(units, df, dataset, kind), total=len(units)):
+            for _name, values in self._store_feature(
+                results, keys, kind, bases, fingerprints
+            ).items():
+                builder.write(_name, values)
+                computed.add(_name)
+            del results
+
+        # load cached features
+        for feature in features:
             _name = feature.__class__.__name__
-            _path = os.path.join(self.pickled_feature_dir, f"{kind}", f"{_name}.pkl")
-            if os.path.isfile(_path):
-                values = self.load_feature(_path)
-            else:
-                values = pd.DataFrame(feature.run(df, dataset))
-                values = reduce_mem_usage(values, _name)
-                self._save_feature(values, _path)
-                print(f"save {_name} feature for {kind} to pickle")
-            X = X.join(values)
-            if X.index.names != index_names:
-                X = X.reset_index().set_index(index_names)
-            del values
-
-        if self.save_X is True:
-            self._save_feature(X, path)
+            if _name not in computed:
+                builder.write(_name, self.cache.get(keys[_name]))
 
+        X = builder.build()
+        del builder
+
+        if self.save is True and memmap is None:
+            self.cache.put(X_key, X, name="X", kind=kind)
+        if memmap is not None:
+            # the files of X are evicted like the entries of the feature cache
+            self.cache.track(memmap_key, memmap.get_paths(), name="X", kind=kind)
+
+        # identifies X for caches of later stages (e.g. binned datasets)
+        X.attrs["cache_key"] = X_key
         return X
 
-    @staticmethod
-    def _save_feature(values, path):
-        values.to_pickle(path)
+    def _make_incremental(self, pending, df, dataset, kind, digest, bases):
+        """ Compute features only for molecules not in a cached version of them
+
+        Molecule-local features of rows of molecules which did not change since
+        a previous version are taken from the cache. Returns the features which
+        have to be computed on all rows and the values of the others.
+        """
+        # features are grouped by the molecules to compute again
+        groups = {}
+        rest = []
+        molecules = pd.Index(get_molecules(df))
+        for feature in pending:
+            _name = feature.__class__.__name__
+            old_key = None
+            if feature.molecule_local:
+                old_key = self.cache.find(bases[_name], kind)
+            old_fingerprint = None
+            if old_key is not None:
+                old_fingerprint = self.cache.get_entry(old_key).get("fingerprint")
+            old_digest = None
+            if old_fingerprint is not None:
+                old_digest = self.cache.get(
+                    self.cache.get_key("digest", kind, old_fingerprint)
+                )
+            reusable = None
+            if old_digest is not None:
+                reusable = get_reusable_molecules(
+                    old_digest, digest, get_digest_columns(feature, df)
+                )
+            if reusable is None:
+                rest.append(feature)
+                continue
+            is_new = ~molecules.isin(reusable)
+            group = is_new.tobytes()
+            if group not in groups:
+                groups[group] = (reusable, is_new, [])
+            groups[group][2].append((feature, old_key))
+
+        ff = FeatureFactory()
+        scheduler = FeatureScheduler(self.n_workers)
+        results = {}
+        for reusable, is_new, items in groups.values():
+            print(
+                f"compute {len(items)} features for {is_new.sum()} of {len(df)} "
+                f"rows of {kind}"
+            )
+            new_values = {}
+            if is_new.any():
+                units = ff.fuse([feature for feature, _ in items])
+                for values in scheduler.run(units, df[is_new], dataset, kind):
+                    new_values.update(values)
+            for feature, old_key in items:
+                _name = feature.__class__.__name__
+                old_values = self.cache.get(old_key)
+                old_values = old_values[
+                    pd.Index(get_molecules(old_values)).isin(reusable)
+                ]
+                if _name in new_values:
+                    old_values = pd.concat([old_values, new_values.pop(_name)])
+                results[_name] = old_values.reindex(df.index)
+        return rest, results
 
-    @classmethod
-    def load_feature(cls, path):
-        return pd.read_pickle(path)
+    def _store_feature(self, results, keys, kind, bases, fingerprints):
+        reduced = {}
+        for _name, values in results.items():
+            values = reduce_mem_usage(
+                values, _name, float_policy=self.float_policy, store=self.dtype_store
+            )
+            self.cache.put(
+                keys[_name],
+                values,
+                name=_name,
+                kind=kind,
+                base=bases[_name],
+                fingerprint=fingerprints[_name],
+            )
+            print(f"save {_name} feature for {kind} to feature cache")
+            reduced[_name] = values
+        return reduced
@@ -1,44 +1,206 @@
 import os
 
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+
+from .graph import BondGraph
+from .schema import (
+    TRAIN_SCHEMA,
+    TEST_SCHEMA,
+    STRUCTURES_SCHEMA,
+    SCALAR_COUPLING_CONTRIBUTIONS_SCHEMA,
+    DIPOLE_MOMENTS_SCHEMA,
+    MAGNETIC_SHIELDING_TENSORS_SCHEMA,
+    MULLIKEN_CHARGES_SCHEMA,
+    POTENTIAL_ENERGY_SCHEMA,
+    get_read_dtypes,
+    apply_schema,
+)
 
 
 class LocalFile:
     def __init__(self, config):
         self.config = config
 
-    def get_train(self):
-        if os.path.isfile(self.config.pickled_train_path):
-            return pd.read_pickle(self.config.pickled_train_path)
-        else:
-            return pd.read_csv(self.config.train_path, nrows=self.config.nrows)
+    def get_train(self, columns=None, molecules=None):
+        """ Preprocessed train table """
+        if self.config.storage_format == "parquet":
+            return self._read_parquet(
+                self.config.parquet_train_path, columns, molecules
+            )
+        return pd.read_pickle(self.config.pickled_train_path)
 
-    def get_test(self):
-        if os.path.isfile(self.config.pickled_test_path):
-            return pd.read_pickle(self.config.pickled_test_path)
-        else:
-            return pd.read_csv(self.config.test_path, nrows=self.config.nrows)
+    def get_test(self, columns=None, molecules=None):
+        """ Preprocessed test table """
+        if self.config.storage_format == "parquet":
+            return self._read_parquet(self.config.parquet_test_path, columns, molecules)
+        return pd.read_pickle(self.config.pickled_test_path)
 
-    def get_structures(self):
-        if os.path.isfile(self.config.pickled_structures_path):
-            return pd.read_pickle(self.config.pickled_structures_path)
-        else:
-            return pd.read_csv(self.config.structures_path)
+    def get_structures(self, columns=None, molecules=None):
+        """ Preprocessed structures table """
+        if self.config.storage_format == "parquet":
+            return self._read_parquet(
+                self.config.parquet_structures_path, columns, molecules
+            )
+        return pd.read_pickle(self.config.pickled_structures_path)
+
+    def get_raw_train(self):
+        return self._read_csv(
+            self.config.train_path, TRAIN_SCHEMA, nrows=self.config.nrows
+        )
+
+    def get_raw_test(self):
+        return self._read_csv(
+            self.config.test_path, TEST_SCHEMA, nrows=self.config.nrows
+        )
+
+    def get_raw_structures(self):
+        return self._read_csv(self.config.structures_path, STRUCTURES_SCHEMA)
 
     def get_submission(self):
         return pd.read_csv(self.config.sample_submission_path)
 
     def get_dipole_moments(self):
-        return pd.read_csv(self.config.dipole_moments_path)
+        return self._read_csv(self.config.dipole_moments_path, DIPOLE_MOMENTS_SCHEMA)
 
     def get_magnetic_shielding_tensors(self):
-        return pd.read_csv(self.config.magnetic_shielding_tensors_path)
+        return self._read_csv(
+            self.config.magnetic_shielding_tensors_path,
+            MAGNETIC_SHIELDING_TENSORS_SCHEMA,
+        )
 
     def get_mulliken_charges(self):
-        return pd.read_csv(self.config.mulliken_charges_path)
+        return self._read_csv(
+            self.config.mulliken_charges_path, MULLIKEN_CHARGES_SCHEMA
+        )
 
     def get_potential_energy(self):
-        return pd.read_csv(self.config.potential_energy_path)
+        return self._read_csv(
+            self.config.potential_energy_path, POTENTIAL_ENERGY_SCHEMA
+        )
 
     def get_scalar_coupling_contributions(self):
-        return pd.read_csv(self.config.scalar_coupling_contributions_path)
+        return self._read_csv(
+            self.config.scalar_coupling_contributions_path,
+            SCALAR_COUPLING_CONTRIBUTIONS_SCHEMA,
+        )
+
+    def get_bond_graph(self):
+        return BondGraph.load(self.config.bond_graph_path)
+
+    def has_preprocessed(self):
+        if self.config.storage_format == "parquet":
+            paths = [
+                self.config.parquet_train_path,
+                self.config.parquet_test_path,
+                self.config.parquet_structures_path,
+            ]
+        else:
+            paths = [
+                self.config.pickled_train_path,
+                self.config.pickled_test_path,
+                self.config.pickled_structures_path,
+            ]
+        paths.append(self.config.bond_graph_path)
+        return all(os.path.isfile(path) for path in paths)
+
+    def save_preprocessed(self, train, test, structures, bonds):
+        os.makedirs(self.config.pickled_data_dir, exist_ok=True)
+        bonds.save(self.config.bond_graph_path)
+        if self.config.storage_format == "parquet":
+            os.makedirs(self.config.parquet_dir, exist_ok=True)
+            self._write_parquet(train, self.config.parquet_train_path)
+            self._write_parquet(test, self.config.parquet_test_path)
+            self._write_parquet(structures, self.config.parquet_structures_path)
+        else:
+            train.to_pickle(self.config.pickled_train_path)
+            test.to_pickle(self.config.pickled_test_path)
+            structures.to_pickle(self.config.pickled_structures_path)
+
+    def _read_csv(self, path, schema, nrows=None):
+        # read with the final dtypes chunk by chunk into arrays allocated for
+        # all rows, so that the peak memory stays close to the size of the
+        # resulting dataframe (concatenating the chunks would double it)
+        n_rows = self._count_rows(path)
+        if nrows is not None:
+            n_rows = min(n_rows, nrows)
+        reader = pd.read_csv(
+            path,
+            usecols=list(schema),
+            dtype=get_read_dtypes(schema),
+            nrows=nrows,
+            chunksize=self.config.chunksize,
+        )
+        arrays = None
+        n = 0
+        for chunk in reader:
+            chunk = apply_schema(chunk, schema)
+            if arrays is None:
+                arrays = {
+                    col: np.empty(n_rows, dtype=chunk[col].dtype)
+                    for col in chunk.columns
+                }
+            if n + len(chunk) > n_rows:
+                # more rows than lines counted (e.g. quoted line breaks)
+                n_rows = n + len(chunk)
+                arrays = {
+                    col: np.resize(values, n_rows) for col, values in arrays.items()
+                }
+            for col, values in arrays.items():
+                values[n : n + len(chunk)] = chunk[col].values
+            n += len(chunk)
+        if arrays is None:
+            return apply_schema(
+                pd.read_csv(
+                    path, usecols=list(schema), dtype=get_read_dtypes(schema), nrows=0
+                ),
+                schema,
+            )
+        return pd.DataFrame(
+            {col: values[:n] for col, values in arrays.items()}, copy=False
+        )
+
+    @staticmethod
+    def _count_rows(path):
+        """ Number of lines after the header """
+        n_lines = 0
+        last = b"\n"
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                n_lines += block.count(b"\n")
+                last = block[-1:]
+        if last != b"\n":
+            n_lines += 1
+        return max(n_lines - 1, 0)
+
+    @staticmethod
+    def sort_by_molecule(df):
+        """ Rows of df sorted by molecule, keeping their order within molecules """
+        if "molecule_name" in df.index.names:
+            molecules = df.index.get_level_values("molecule_name")
+            if not molecules.is_monotonic_increasing:
+                df = df.sort_index(
+                    level="molecule_name", sort_remaining=False, kind="mergesort"
+                )
+        elif not df["molecule_name"].is_monotonic_increasing:
+            df = df.sort_values("molecule_name", kind="mergesort")
+        return df
+
+    def _write_parquet(self, df, path):
+        # rows are sorted by molecule so that row group statistics can be used
+        # to skip row groups when filtering by molecule
+        df = self.sort_by_molecule(df)
+        df.to_parquet(path, engine="pyarrow", row_group_size=self.config.row_group_size)
+
+    @staticmethod
+    def _read_parquet(path, columns=None, molecules=None):
+        if columns is not None:
+            # read only the columns stored in the file (index columns are
+            # restored from the pandas metadata)
+            names = set(pq.read_schema(path).names)
+            columns = [col for col in columns if col in names]
+        filters = None
+        if molecules is not None:
+            filters = [("molecule_name", "in", list(molecules))]
+        return pd.read_parquet(path, engine="pyarrow", columns=columns, filters=filters)
@@ -1,7 +1,12 @@
 from .config import Config
 from .data import DatasetCreator
 from .dataproc import DataProcessor
-from .predict import SubTargetPrediction, TargetPrediction
+from .predict import (
+    SubTargetPrediction,
+    MultiTargetPrediction,
+    RegisteredPrediction,
+    TargetPrediction,
+)
 
 
 class Experiment:
@@ -24,7 +29,51 @@ class Experiment:
             self.X_train_, self.y_train_, self.X_test_ = processor.run(self.dataset_)
 
         sub_predict = SubTargetPrediction(self.config)
-        y_pred = sub_predict.run(self.X_train_, self.y_train_, self.X_test_)
+        y_pred = sub_predict.run(
+            self.X_train_,
+            self.y_train_,
+            self.X_test_,
+            test_types=self.dataset_.test["type"].values,
+        )
+        return y_pred
+
+    def predict_for_subtarget(self, version=None):
+        print("Target:", self.config.target_name)
+
+        if self.dataset_ is None:
+            creator = DatasetCreator()
+            self.dataset_ = creator.run()
+
+        if self.X_test_ is None:
+            processor = DataProcessor(self.config)
+            self.X_test_ = processor.run_for_test(self.dataset_)
+
+        registered_predict = RegisteredPrediction(self.config)
+        y_pred = registered_predict.run(
+            self.X_test_,
+            test_types=self.dataset_.test["type"].values,
+            version=version,
+        )
+        return y_pred
+
+    def run_for_subtargets(self):
+        print("Targets:", self.config.target_names)
+
+        if self.dataset_ is None:
+            creator = DatasetCreator()
+            self.dataset_ = creator.run()
+
+        if self.X_train_ is None:
+            processor = DataProcessor(self.config)
+            self.X_train_, self.y_train_, self.X_test_ = processor.run(self.dataset_)
+
+        multi_predict = MultiTargetPrediction(self.config)
+        y_pred = multi_predict.run(
+            self.X_train_,
+            self.y_train_,
+            self.X_test_,
+            test_types=self.dataset_.test["type"].values,
+        )
         return y_pred
 
     def run_for_target(self):
@@ -1,9 +1,13 @@
 import inspect
 import os
 
+import numpy as np
 import pandas as pd
 
+from .aggregate import GroupAggregator
 from .config import Config
+from .schema import TYPE_VOCAB, TYPE_0_VOCAB, ATOM_VOCAB
+from .store import PredictionStore
 
 
 class FeatureFactory:
@@ -19,9 +23,13 @@ class FeatureFactory:
             obj = globals()[name]
             if inspect.isclass(obj) and obj not in [
                 Config,
+                GroupAggregator,
+                PredictionStore,
                 FeatureFactory,
+                FusedFeature,
                 Feature,
                 BasicFeature,
+                StatisticsFeature,
                 MoleculeStatisticsFeature,
                 AtomStatisticsFeature,
                 TypeStatisticsFeature,
@@ -30,125 +38,229 @@ class FeatureFactory:
                 lst.append(obj.__name__)
         return lst
 
+    def required_columns(self, feature_names):
+        columns = []
+        for name in feature_names:
+            if name not in globals():
+                raise ValueError("No feature defined named with {}".format(name))
+            for col in globals()[name].get_required_columns():
+                if col not in columns:
+                    columns.append(col)
+        return columns
+
+    def fuse(self, features):
+        """ Put features sharing a group key together into FusedFeature """
+        units = []
+        fused = {}
+        for feature in features:
+            if feature.group_key is None:
+                units.append(feature)
+                continue
+            key = tuple(feature.group_key)
+            if key not in fused:
+                fused[key] = FusedFeature(key)
+                units.append(fused[key])
+            fused[key].features.append(feature)
+        return units
+
+
+class FusedFeature:
+    """ Statistics features sharing a group key computed over one grouping """
+
+    def __init__(self, group_key, features=None):
+        self.group_key = list(group_key)
+        self.features = list(features) if features else []
+
+    @property
+    def feature_names(self):
+        return [feature.__class__.__name__ for feature in self.features]
+
+    @property
+    def depends_on(self):
+        return [name for feature in self.features for name in feature.depends_on]
+
+    def compute(self, df, dataset, kind):
+        return self.run(df, dataset)
+
+    def run(self, df, dataset, aggregator=None):
+        if aggregator is None:
+            aggregator = GroupAggregator(df, self.group_key)
+        results = {}
+        for feature in self.features:
+            values = aggregator.transform(df, feature.get_aggregations())
+            results[feature.__class__.__name__] = values.fillna(0)
+        return results
+
 
 class Feature:
+
+    group_key = None
+    depends_on = []
+    # whether the values of a molecule depend only on the rows of the molecule
+    molecule_local = True
+
     def __init___(self, **kwargs):
         self.name = str(self)
         for key, val in kwargs.items():
             setattr(self, key, val)
 
-    def run(self, df, dataset):
-        values = self.extract(df, dataset)
+    @property
+    def feature_names(self):
+        return [self.__class__.__name__]
+
+    def run(self, df, dataset, kind):
+        values = self.extract(df, dataset, kind)
         values = values.fillna(0)
         return values
 
-    def extract(self, df, dataset):
+    def compute(self, df, dataset, kind):
+        """ {feature name: values} of df, the "train" or "test" table """
+        return {self.__class__.__name__: pd.DataFrame(self.run(df, dataset, kind))}
+
+    def is_ready(self, df, kind):
+        return True
+
+    def get_external_fingerprint(self):
+        """ Fingerprint of inputs read from outside of the dataset """
+        return ""
+
+    def extract(self, df, dataset, kind):
+        raise NotImplementedError
+
+    def get_column_names(self, df):
         raise NotImplementedError
 
-    @staticmethod
-    def _get_converted_multi_columns(values, head_name=None):
-        col_names = [col[0] + "_" + col[1] for col in values.columns.values]
-        if head_name:
-            col_names = [head_name + "_" + col for col in col_names]
-        return col_names
+    @classmethod
+    def get_required_columns(cls):
+        return []
 
 
 class BasicFeature(Feature):
 
     column = None
     prefix = None
+    vocabulary = None
 
-    def extract(self, df, dataset):
+    def extract(self, df, dataset, kind):
         values = df[self.column]
-        if values.dtype == "O":
+        if self.vocabulary is not None:
+            values = self._get_one_hot(values)
+        elif values.dtype == "O" or values.dtype.name == "category":
             values = pd.get_dummies(values, prefix=self.prefix)
         return values
 
+    def _get_one_hot(self, values):
+        # columns are the same as pd.get_dummies over all labels
+        codes = values.values.astype(np.int64)
+        one_hot = np.zeros((len(codes), len(self.vocabulary)), dtype=np.uint8)
+        valid = codes >= 0
+        one_hot[np.flatnonzero(valid), codes[valid]] = 1
+        if self.prefix:
+            columns = [f"{self.prefix}_{label}" for label in self.vocabulary.labels]
+        else:
+            columns = list(self.vocabulary.labels)
+        return pd.DataFrame(one_hot, index=values.index, columns=columns)
+
+    def get_column_names(self, df):
+        if self.vocabulary is not None:
+            labels = self.vocabulary.labels
+        elif df[self.column].dtype.name == "category":
+            labels = list(df[self.column].cat.categories)
+        elif df[self.column].dtype == "O":
+            labels = sorted(df[self.column].dropna().unique())
+        else:
+            return [self.column]
+        if self.prefix:
+            return [f"{self.prefix}_{label}" for label in labels]
+        return [str(label) for label in labels]
+
+    @classmethod
+    def get_required_columns(cls):
+        return [cls.column]
 
-class MoleculeStatisticsFeature(Feature):
+
+class StatisticsFeature(Feature):
 
     column = None
     representative_values = None
     col_names = None
     head_name = None
 
-    def extract(self, df, dataset):
-        agg = {self.column: self.representative_values}
-        values = df.groupby("molecule_name").agg(agg)
-        if self.col_names:
-            values.name = self.col_names
-        else:
-            values.columns = self._get_converted_multi_columns(
-                values, head_name=self.head_name
-            )
-        return values
+    def extract(self, df, dataset, kind):
+        aggregator = GroupAggregator(df, self.group_key)
+        return aggregator.transform(df, self.get_aggregations())
+
+    @classmethod
+    def get_aggregations(cls):
+        funcs = cls.representative_values
+        if isinstance(funcs, str):
+            funcs = [funcs]
+        if cls.col_names:
+            return [(cls.column, funcs[0], cls.col_names)]
+        aggregations = []
+        for func in funcs:
+            name = f"{cls.column}_{func}"
+            if cls.head_name:
+                name = f"{cls.head_name}_{name}"
+            aggregations.append((cls.column, func, name))
+        return aggregations
+
+    def get_column_names(self, df):
+        return [name for _, _, name in self.get_aggregations()]
+
+    @classmethod
+    def get_required_columns(cls):
+        return [cls.column]
 
 
-class AtomStatisticsFeature(Feature):
+class MoleculeStatisticsFeature(StatisticsFeature):
+
+    group_key = ["molecule_name"]
+
+
+class AtomStatisticsFeature(StatisticsFeature):
 
     atom_idx = None
-    column = None
-    representative_values = None
-    col_names = None
-    head_name = None
 
-    def extract(self, df, dataset):
-        agg = {self.column: self.representative_values}
-        values = df.groupby(["molecule_name", f"atom_index_{self.atom_idx}"]).agg(agg)
-        if self.col_names:
-            values.columns = [self.col_names]
-        else:
-            values.columns = self._get_converted_multi_columns(
-                values, head_name=self.head_name
-            )
-        return values
+    @property
+    def group_key(self):
+        return ["molecule_name", f"atom_index_{self.atom_idx}"]
 
 
-class TypeStatisticsFeature(Feature):
+class TypeStatisticsFeature(StatisticsFeature):
 
-    column = None
-    representative_values = None
-    col_names = None
-    head_name = None
+    group_key = ["molecule_name", "type"]
 
-    def extract(self, df, dataset):
-        agg = {self.column: self.representative_values}
-        values = df.groupby(["molecule_name", "type"]).agg(agg)
-        if self.col_names:
-            values.columns = [self.col_names]
-        else:
-            values.columns = self._get_converted_multi_columns(
-                values, head_name=self.head_name
-            )
-        df_ = df["type"].reset_index()
-        values = values.reset_index()
-        values = df_.merge(values, on=["molecule_name", "type"])
-        values = values.set_index(["molecule_name", "atom_index_0", "atom_index_1"])
-        values = values.drop(columns="type")
-        return values
+    @classmethod
+    def get_required_columns(cls):
+        return ["type", cls.column]
 
 
 class MoleculeType(BasicFeature):
 
     column = "type"
+    vocabulary = TYPE_VOCAB
 
 
 class MoleculeType0(BasicFeature):
 
     column = "type_0"
     prefix = "type"
+    vocabulary = TYPE_0_VOCAB
 
 
 class Atom0(BasicFeature):
 
     column = "atom_0"
     prefix = "atom_0"
+    vocabulary = ATOM_VOCAB
 
 
 class Atom1(BasicFeature):
 
     column = "atom_1"
     prefix = "atom_1"
+    vocabulary = ATOM_VOCAB
 
 
 class AtomX0(BasicFeature):
@@ -511,19 +623,41 @@ class PredictedFeature(Feature):
     """ Predicted features that construct scalar coupling constant """
 
     column = None
-
-    def extract(self, df, dataset):
-        if self.column in df.columns:
-            values = df[self.column]
-        else:
-            try:
-                path = os.path.join(
-                    Config().pickled_feature_dir, "test", f"{self.column}.pkl"
-                )
-                values = pd.read_pickle(path)
-            except ValueError:
-                print(f"Not found pickled {self.column}.")
-        return values
+    molecule_local = False
+
+    def extract(self, df, dataset, kind):
+        # train values are out-of-fold predictions, never the true values
+        values = self._get_store().get(self.column, kind, columns=[self.column])
+        if values is None:
+            values = pd.read_pickle(self._get_pickle_path())
+        return values[self.column].reindex(df.index)
+
+    def get_column_names(self, df):
+        return [self.column]
+
+    def is_ready(self, df, kind):
+        # the values come from the sub-target prediction stage
+        if self._get_store().has(self.column, kind):
+            return True
+        return kind == "test" and os.path.isfile(self._get_pickle_path())
+
+    def get_external_fingerprint(self):
+        store = self._get_store()
+        version = store.get_version(self.column)
+        fingerprint = f"{store.experiment}/v{version}" if version is not None else ""
+        path = self._get_pickle_path()
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            fingerprint += f"-{stat.st_size}-{stat.st_mtime_ns}"
+        return fingerprint
+
+    def _get_store(self):
+        config = Config()
+        return PredictionStore(config.prediction_store_dir, config.experiment_name)
+
+    def _get_pickle_path(self):
+        # test predictions saved before the prediction store
+        return os.path.join(Config().pickled_feature_dir, "test", f"{self.column}.pkl")
 
 
 class FermiContact(PredictedFeature):
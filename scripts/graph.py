@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import take
+
+
+def get_molecule_offsets(molecule_ids):
+    """ Offsets of molecules in an array sorted by molecule
+
+    The atoms of the i-th molecule are rows offsets[i] to offsets[i + 1] - 1.
+    """
+    molecule_ids = np.asarray(molecule_ids)
+    if len(molecule_ids) == 0:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, molecule_ids[1:] != molecule_ids[:-1]])
+    return np.append(starts, len(molecule_ids)).astype(np.int64)
+
+
+class NeighborEngine:
+    """ Find bonds between atoms in the same molecule
+
+    Molecules of the same size are processed together in batches, so the
+    pairwise distances are computed on dense (molecules, atoms, atoms) arrays
+    without any limit on the number of atoms in a molecule.
+    """
+
+    def __init__(self, batch_size=10000, min_dist=0.0001):
+        self.batch_size = batch_size
+        self.min_dist = min_dist
+
+    def run(self, positions, radius, offsets):
+        positions = np.asarray(positions)
+        radius = np.asarray(radius)
+        sources, targets, lengths = [], [], []
+        for rows in self._iter_batches(offsets):
+            dists, bond = self._get_bonds(positions, radius, rows)
+            b, i, j = np.nonzero(bond)
+            sources.append(rows[b, i])
+            targets.append(rows[b, j])
+            lengths.append(dists[b, i, j].astype(np.float32))
+
+        if sources:
+            sources = np.concatenate(sources)
+            targets = np.concatenate(targets)
+            lengths = np.concatenate(lengths)
+        else:
+            sources = np.zeros(0, dtype=np.int64)
+            targets = np.zeros(0, dtype=np.int64)
+            lengths = np.zeros(0, dtype=np.float32)
+        return BondGraph.from_edges(sources, targets, lengths, len(positions))
+
+    def _iter_batches(self, offsets):
+        starts = offsets[:-1]
+        sizes = np.diff(offsets)
+        for size in np.unique(sizes):
+            starts_ = starts[sizes == size]
+            for i in range(0, len(starts_), self.batch_size):
+                batch = starts_[i : i + self.batch_size]
+                yield batch[:, np.newaxis] + np.arange(size)
+
+    def _get_bonds(self, positions, radius, rows):
+        p = positions[rows].astype(np.float64)
+        r = radius[rows]
+        dists = np.linalg.norm(p[:, :, np.newaxis] - p[:, np.newaxis], axis=-1)
+        r_bond = r[:, :, np.newaxis] + r[:, np.newaxis]
+        bond = (dists > self.min_dist) & (dists < r_bond)
+        return dists, bond
+
+
+class BondGraph:
+    """ Bonds between atoms stored as CSR adjacency
+
+    The bonds of the atom in the i-th row of structures are
+    indices[indptr[i]:indptr[i + 1]] with lengths[indptr[i]:indptr[i + 1]].
+    """
+
+    def __init__(self, indptr, indices, lengths):
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+
+    @classmethod
+    def from_edges(cls, sources, targets, lengths, n_atoms):
+        order = np.lexsort((targets, sources))
+        counts = np.bincount(sources, minlength=n_atoms)
+        indptr = np.zeros(n_atoms + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(indptr, targets[order].astype(np.int32), lengths[order])
+
+    @classmethod
+    def concat(cls, graphs):
+        """ Graph of structures made by concatenating those of graphs """
+        indptr = [np.zeros(1, dtype=np.int64)]
+        indices = []
+        n_atoms = 0
+        n_bonds = 0
+        for graph in graphs:
+            indptr.append(graph.indptr[1:] + n_bonds)
+            indices.append(graph.indices + n_atoms)
+            n_atoms += graph.n_atoms
+            n_bonds += len(graph.indices)
+        lengths = np.concatenate([graph.lengths for graph in graphs])
+        return cls(
+            np.concatenate(indptr), np.concatenate(indices).astype(np.int32), lengths
+        )
+
+    @property
+    def n_atoms(self):
+        return len(self.indptr) - 1
+
+    def sources(self):
+        return np.repeat(np.arange(self.n_atoms), self.count())
+
+    def count(self):
+        return np.diff(self.indptr).astype(np.int32)
+
+    def sum(self):
+        return np.bincount(
+            self.sources(), weights=self.lengths, minlength=self.n_atoms
+        )
+
+    def mean(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (self.sum() / self.count()).astype(np.float32)
+
+    def std(self):
+        sources = self.sources()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum() / self.count()
+            dev = (self.lengths - mean[sources]) ** 2
+            var = np.bincount(sources, weights=dev, minlength=self.n_atoms)
+            var = var / self.count()
+        return np.sqrt(var).astype(np.float32)
+
+    def save(self, path):
+        np.savez(path, indptr=self.indptr, indices=self.indices, lengths=self.lengths)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["indptr"], data["indices"], data["lengths"])
+
+
+class AtomIndex:
+    """ Row positions of atoms in structures sorted by molecule and atom index
+
+    Atoms are looked up by offset[molecule] + atom_index, so mapping atom
+    information onto atom pairs is a gather instead of a join.
+    """
+
+    def __init__(self, molecule_ids, atom_index):
+        molecule_ids = np.asarray(molecule_ids)
+        atom_index = np.asarray(atom_index)
+        offsets = get_molecule_offsets(molecule_ids)
+        self.starts = offsets[:-1]
+        self.sizes = np.diff(offsets)
+
+        expected = np.arange(len(atom_index)) - np.repeat(self.starts, self.sizes)
+        if not np.array_equal(atom_index, expected):
+            raise ValueError(
+                "atoms have to be sorted by molecule and atom_index has to be "
+                "0, 1, 2, ... in each molecule"
+            )
+
+        molecules = molecule_ids[self.starts]
+        if molecules.dtype.kind in "iu" and np.all(molecules >= 0):
+            size = molecules.max() + 1 if len(molecules) else 0
+            self.lookup = np.full(size, -1, dtype=np.int64)
+            self.lookup[molecules] = np.arange(len(molecules))
+            self.molecules = None
+        else:
+            self.lookup = None
+            self.molecules = pd.Index(molecules)
+
+    def get_rows(self, molecule_ids, atom_index):
+        """ Rows of the given atoms (-1 where the atom does not exist) """
+        molecule_ids = np.asarray(molecule_ids)
+        atom_index = np.asarray(atom_index).astype(np.int64)
+        if self.lookup is not None:
+            in_range = (molecule_ids >= 0) & (molecule_ids < len(self.lookup))
+            pos = np.full(len(molecule_ids), -1, dtype=np.int64)
+            pos[in_range] = self.lookup[molecule_ids[in_range]]
+        else:
+            pos = self.molecules.get_indexer(molecule_ids)
+
+        found = pos >= 0
+        rows = np.full(len(molecule_ids), -1, dtype=np.int64)
+        valid = found.copy()
+        valid[found] = (atom_index[found] >= 0) & (
+            atom_index[found] < self.sizes[pos[found]]
+        )
+        rows[valid] = self.starts[pos[valid]] + atom_index[valid]
+        return rows
+
+    @staticmethod
+    def take(values, rows):
+        """ Gather values at rows, filling missing rows (-1) with NaN """
+        return take(values, rows, allow_fill=True)
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from .aggregate import GroupAggregator
+
+# column of digests holding the hash of the index of rows
+INDEX_DIGEST = "_index"
+
+# odd constant mixing the hash of the index into the hash of each value
+MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def get_molecules(df):
+    return GroupAggregator._get_values(df, "molecule_name")
+
+
+def get_molecule_digest(df):
+    """ Hash of each column over the rows of each molecule
+
+    The result has one column per column of df and INDEX_DIGEST, indexed by
+    molecule. Every value is hashed with the index of its row and the hashes
+    are summed with wraparound, so the digest of a column depends neither on
+    the other columns (or their order) nor on where the rows are in the table.
+    """
+    aggregator = GroupAggregator(df, ["molecule_name"])
+    index_hash = pd.util.hash_pandas_object(df.index).values
+
+    def sum_by_molecule(hashes):
+        if len(hashes) == 0:
+            return np.zeros(0, dtype=np.uint64)
+        return np.add.reduceat(hashes[aggregator.order], aggregator.starts)
+
+    data = {INDEX_DIGEST: sum_by_molecule(index_hash)}
+    for col in df.columns:
+        value_hash = pd.util.hash_pandas_object(df[col], index=False).values
+        data[col] = sum_by_molecule(value_hash ^ (index_hash * MIX))
+    index = pd.Index(np.unique(get_molecules(df)), name="molecule_name")
+    return pd.DataFrame(data, index=index)
+
+
+def get_digest_columns(feature, df):
+    """ Columns of df the values of the feature are computed from """
+    columns = list(feature.get_required_columns()) + list(feature.group_key or [])
+    return sorted({col for col in columns if col in df.columns})
+
+
+def get_reusable_molecules(old_digest, new_digest, columns):
+    """ Molecules whose rows have the same index and values of columns
+
+    None if the old digest does not cover the columns.
+    """
+    columns = [INDEX_DIGEST] + list(columns)
+    if not set(columns).issubset(old_digest.columns):
+        return None
+    common = new_digest.index.intersection(old_digest.index)
+    same = np.all(
+        old_digest.loc[common, columns].values
+        == new_digest.loc[common, columns].values,
+        axis=1,
+    )
+    return common[same]
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import lightgbm
+
+
+class FoldEnsemblePredictor:
+    """ Average of fold models predicted batch by batch into one buffer
+
+    Every fold model predicts the same batch of rows and adds to the slice of
+    a preallocated output, so the memory used is the output and one batch
+    instead of a full prediction per fold. Batches are predicted on threads
+    since lightgbm releases the GIL.
+    """
+
+    def __init__(self, models, batch_size=100000, n_workers=1, n_threads=1):
+        self.models = list(models)
+        self.batch_size = batch_size
+        self.n_workers = max(1, n_workers)
+        self.n_threads = max(1, n_threads)
+        self.boosters_ = None
+
+    @property
+    def boosters(self):
+        # model files are loaded when predicting for the first time
+        if self.boosters_ is None:
+            self.boosters_ = [self._get_booster(model) for model in self.models]
+        return self.boosters_
+
+    def predict(self, X, out=None, rows=None):
+        """ Predictions of X, or of the rows of X at the positions rows
+
+        Batches of rows are taken from X one at a time, so the rows of a fold
+        of a memory-mapped X are not copied at once.
+        """
+        boosters = self.boosters
+        n_rows = len(X) if rows is None else len(rows)
+        if out is None:
+            out = np.zeros(n_rows, dtype=np.float64)
+        else:
+            out[:] = 0
+
+        def predict_batch(start):
+            stop = min(start + self.batch_size, n_rows)
+            batch = slice(start, stop) if rows is None else rows[start:stop]
+            X_ = X.iloc[batch] if hasattr(X, "iloc") else X[batch]
+            for booster in boosters:
+                out[start:stop] += booster.predict(X_, num_threads=self.n_threads)
+            out[start:stop] /= len(boosters)
+
+        starts = range(0, n_rows, self.batch_size)
+        if self.n_workers == 1 or len(starts) == 1:
+            for start in starts:
+                predict_batch(start)
+        else:
+            with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+                list(executor.map(predict_batch, starts))
+        return out
+
+    @staticmethod
+    def _get_booster(model):
+        if isinstance(model, lightgbm.Booster):
+            return model
+        if isinstance(model, str):
+            return lightgbm.Booster(model_file=model)
+        # fitted LGBMRegressor
+        return model.booster_
@@ -0,0 +1,126 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class FeatureMatrixBuilder:
+    """ Assemble features into one preallocated column-major block
+
+    The output columns of every feature are known before any feature is
+    computed, so the whole matrix is allocated once and each feature writes
+    into its own slice of columns.
+    """
+
+    def __init__(self, index, dtype=np.float32, memmap=None):
+        self.index = index
+        self.dtype = dtype
+        self.memmap = memmap
+        self.columns = []
+        self.slices = {}
+        self.block = None
+
+    def allocate(self, feature_columns):
+        """ Allocate the block from (feature name, column names) pairs """
+        self.columns = []
+        self.slices = {}
+        for name, columns in feature_columns:
+            start = len(self.columns)
+            self.columns.extend(columns)
+            self.slices[name] = slice(start, len(self.columns))
+        shape = (len(self.index), len(self.columns))
+        if self.memmap is not None:
+            self.block = self.memmap.create(shape, self.dtype)
+        else:
+            self.block = np.zeros(shape, dtype=self.dtype, order="F")
+
+    def get_columns(self, name):
+        return self.columns[self.slices[name]]
+
+    def write(self, name, values):
+        columns = self.get_columns(name)
+        if isinstance(values, pd.Series):
+            values = values.to_frame(columns[0] if len(columns) == 1 else None)
+        if list(values.columns) != columns:
+            raise ValueError(
+                "Columns of {} do not match: {} != {}".format(
+                    name, list(values.columns), columns
+                )
+            )
+        if not values.index.equals(self.index):
+            values = values.reindex(self.index)
+        start = self.slices[name].start
+        for i, col in enumerate(columns):
+            self.block[:, start + i] = values[col].values
+
+    def build(self):
+        if self.memmap is not None:
+            self.block.flush()
+            self.memmap.save_manifest(self.index, self.columns, self.dtype)
+            return self.memmap.load()
+        return pd.DataFrame(
+            self.block, index=self.index, columns=self.columns, copy=False
+        )
+
+
+class MemmapMatrix:
+    """ Feature matrix stored as a memory-mapped column-major array
+
+    The array is written to {path}.bin with a json manifest of its shape,
+    dtype and columns, and the row index is pickled to {path}.index.pkl.
+    Every process opening the same path shares the pages of the file, so
+    folds and tuning workers read X without holding their own copy.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data_path = f"{path}.bin"
+        self.manifest_path = f"{path}.json"
+        self.index_path = f"{path}.index.pkl"
+
+    def exists(self):
+        return os.path.isfile(self.manifest_path) and os.path.isfile(self.data_path)
+
+    def get_paths(self):
+        return [self.data_path, self.manifest_path, self.index_path]
+
+    def create(self, shape, dtype):
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        if os.path.isfile(self.manifest_path):
+            os.remove(self.manifest_path)
+        return np.memmap(self.data_path, dtype=dtype, mode="w+", shape=shape, order="F")
+
+    def save_manifest(self, index, columns, dtype):
+        pd.to_pickle(index, self.index_path)
+        manifest = {
+            "shape": [len(index), len(columns)],
+            "dtype": np.dtype(dtype).name,
+            "order": "F",
+            "columns": list(columns),
+        }
+        # the manifest is written last and marks the matrix as complete
+        with open(self.manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    def load_array(self):
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        array = np.memmap(
+            self.data_path,
+            dtype=manifest["dtype"],
+            mode="r",
+            shape=tuple(manifest["shape"]),
+            order=manifest["order"],
+        )
+        return array, manifest["columns"]
+
+    def load(self):
+        array, columns = self.load_array()
+        index = pd.read_pickle(self.index_path)
+        X = pd.DataFrame(array, index=index, columns=columns, copy=False)
+        # lets other processes open the same file instead of copying X
+        X.attrs["memmap_path"] = self.path
+        return X
@@ -0,0 +1,41 @@
+import numpy as np
+
+# lower bound of MAE used by the competition metric
+MIN_MAE = 1e-9
+
+
+def group_log_mae(y_true, y_pred, types, n_types=None):
+    """ Mean over coupling types of log(MAE) computed with segment sums """
+    types = np.asarray(types).astype(np.int64)
+    if n_types is None:
+        n_types = types.max() + 1 if len(types) else 0
+    errors = np.abs(
+        np.asarray(y_true, dtype=np.float64) - np.asarray(y_pred, dtype=np.float64)
+    )
+    count = np.bincount(types, minlength=n_types)
+    total = np.bincount(types, weights=errors, minlength=n_types)
+    present = count > 0
+    mae = total[present] / count[present]
+    return np.mean(np.log(np.maximum(mae, MIN_MAE)))
+
+
+def calculate_score(y_valid, y_pred, target_name):
+    """ group_log_mae of the target_name column of y_valid per "type" """
+    return group_log_mae(y_valid[target_name].values, y_pred, y_valid["type"].values)
+
+
+class GroupLogMAE:
+    """ group_log_mae of a fixed validation set as a LightGBM metric """
+
+    name = "group_log_mae"
+
+    def __init__(self, types):
+        self.types = np.asarray(types).astype(np.int64)
+
+    def feval(self, preds, dataset):
+        """ feval of lightgbm.train """
+        return self.name, group_log_mae(dataset.get_label(), preds, self.types), False
+
+    def eval_metric(self, y_true, y_pred):
+        """ eval_metric of LGBMRegressor.fit """
+        return self.name, group_log_mae(y_true, y_pred, self.types), False
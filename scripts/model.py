@@ -1,7 +1,11 @@
+import hashlib
+import os
+
 import numpy as np
 import lightgbm
 import sklearn.linear_model
-from sklearn.metrics import mean_absolute_error
+
+from .metric import calculate_score
 
 
 class LGBMRegressor(lightgbm.LGBMRegressor):
@@ -84,6 +88,9 @@ class LGBMRegressor(lightgbm.LGBMRegressor):
             "categorical_feature": categorical_feature,
             "callbacks": callbacks,
         }
+        if callable(eval_metric) and "metric" not in self.get_params():
+            # track only the custom metric for early stopping
+            self.set_params(metric="None")
         super().fit(X, y, **params)
         return self
 
@@ -104,14 +111,113 @@ class LGBMRegressor(lightgbm.LGBMRegressor):
         }
         return super().predict(X, **params, **kwargs)
 
-    def calculate_score(self, y_valid, y_pred):
-        score = []
-        for scalar_coupling_type in y_valid["type"].unique():
-            y_valid_ = y_valid.reset_index(drop=True)
-            idx = y_valid_.query(f"type=='{scalar_coupling_type}'").index.values
-            y_true = y_valid_.drop(columns="type").iloc[idx]
-            score.append(np.log(mean_absolute_error(y_true, y_pred[idx])))
-        return np.mean(score)
+    def fit_dataset(
+        self,
+        train_set,
+        valid_set=None,
+        feval=None,
+        early_stopping_rounds=None,
+        verbose=True,
+        callbacks=None,
+    ):
+        """ Fit on a constructed lightgbm.Dataset (e.g. a BinnedDataset subset) """
+        valid_sets = [valid_set] if valid_set is not None else None
+        valid_names = ["valid_0"] if valid_set is not None else None
+        params = self._get_train_params()
+        if feval is not None and "metric" not in params:
+            # track only the custom metric for early stopping
+            params["metric"] = "None"
+        evals_result = {}
+        booster = lightgbm.train(
+            params,
+            train_set,
+            num_boost_round=self.n_estimators,
+            valid_sets=valid_sets,
+            valid_names=valid_names,
+            feval=feval,
+            early_stopping_rounds=early_stopping_rounds,
+            evals_result=evals_result,
+            verbose_eval=verbose,
+            callbacks=callbacks,
+        )
+        self._Booster = booster
+        self._n_features = booster.num_feature()
+        self._n_features_in = booster.num_feature()
+        self._best_iteration = booster.best_iteration
+        self._best_score = booster.best_score
+        self._evals_result = evals_result
+        self.fitted_ = True
+        return self
+
+    def _get_train_params(self):
+        params = self.get_params()
+        for key in [
+            "n_estimators",
+            "silent",
+            "importance_type",
+            "class_weight",
+            "n_jobs",
+            "random_state",
+            "objective",
+        ]:
+            params.pop(key, None)
+        params["objective"] = self.objective or "regression"
+        params["num_threads"] = self.n_jobs
+        params["verbose"] = -1 if self.silent else 1
+        if self.random_state is not None:
+            params["seed"] = self.random_state
+        return params
+
+    def calculate_score(self, y_valid, y_pred, target_name):
+        return calculate_score(y_valid, y_pred, target_name)
+
+
+class BinnedDataset:
+    """ LightGBM Dataset binned once per feature matrix
+
+    The histogram bins of X are built once and saved as a LightGBM binary
+    file named after the feature cache key of X, so later runs load the bins
+    instead of rebuilding them. Folds and trials train on subsets of it.
+    Given a FeatureCache, the files are evicted with its entries.
+    """
+
+    def __init__(self, X, label, cache_dir=None, params=None, cache=None):
+        self.params = dict(params or {})
+        path = self._get_path(X, cache_dir)
+        key = None
+        if path is not None and cache is not None:
+            key = cache.get_key("binned", path)
+            cache.protect(cache.protected | {key})
+        if path is not None and os.path.isfile(path):
+            print("load binned dataset")
+            if key is not None:
+                cache.touch(key)
+            self.dataset = lightgbm.Dataset(path, params=self.params).construct()
+            self.set_label(label)
+        else:
+            # the raw data are freed once binned (subsets need only the bins)
+            self.dataset = lightgbm.Dataset(
+                X, label=np.asarray(label), params=self.params
+            ).construct()
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                self.dataset.save_binary(path)
+                if key is not None:
+                    cache.track(key, [path], name="binned")
+
+    def set_label(self, label):
+        self.dataset.set_label(np.asarray(label))
+
+    def subset(self, idx):
+        return self.dataset.subset(np.sort(idx), params=self.params)
+
+    def _get_path(self, X, cache_dir):
+        key = X.attrs.get("cache_key") if hasattr(X, "attrs") else None
+        if cache_dir is None or key is None:
+            return None
+        h = hashlib.sha1(key.encode())
+        h.update(repr(sorted(self.params.items())).encode())
+        return os.path.join(cache_dir, f"{h.hexdigest()}.bin")
 
 
 class LogisticRegression(sklearn.linear_model.LogisticRegression):
@@ -160,11 +266,5 @@ class LogisticRegression(sklearn.linear_model.LogisticRegression):
     def predict(self, X):
         return super.predict(X)
 
-    def calculate_score(self, y_valid, y_pred):
-        score = []
-        for scalar_coupling_type in y_valid["type"].unique():
-            y_valid_ = y_valid.reset_index(drop=True)
-            idx = y_valid_.query(f"type=='{scalar_coupling_type}'").index.values
-            y_true = y_valid_.drop(columns="type").iloc[idx]
-            score.append(np.log(mean_absolute_error(y_true, y_pred[idx])))
-        return np.mean(score)
+    def calculate_score(self, y_valid, y_pred, target_name):
+        return calculate_score(y_valid, y_pred, target_name)
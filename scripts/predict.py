@@ -1,68 +1,302 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import KFold
 
-from .model import LGBMRegressor, LogisticRegression
+from .schema import TYPE_VOCAB
+from .cache import FeatureCache
+from .model import LGBMRegressor, LogisticRegression, BinnedDataset
 from .tune import ParameterTuning
+from .metric import GroupLogMAE
+from .inference import FoldEnsemblePredictor
+from .store import PredictionStore
+from .registry import ModelRegistry
+from .utility import get_folds
 
 
 class SubTargetPrediction:
     def __init__(self, config):
         self.config = config
-        self.pickled_feature_dir = config.pickled_feature_dir
+        self.prediction_store_dir = config.prediction_store_dir
+        self.experiment_name = config.experiment_name
         self.target_name = config.target_name
         self.tuning = config.tuning
         self.n_splits = config.n_splits
         self.save = config.save
         self.seed = config.seed
+        self.budget = config.budget
+        self.binned_dataset = config.binned_dataset
+        self.binned_dataset_dir = config.binned_dataset_dir
+        self.cache = FeatureCache(config.feature_cache_dir, config.feature_cache_budget)
+        self.dataset_params = config.dataset_params
+        self.per_type = config.per_type
+        self.n_type_workers = config.n_type_workers
+        self.predict_batch_size = config.predict_batch_size
+        self.n_predict_workers = config.n_predict_workers
+        self.save_models = config.save_models
+        self.model_registry_dir = config.model_registry_dir
 
-    def run(self, X_train, y_train, X_test):
+    def run(
+        self, X_train, y_train, X_test, test_types=None, folds=None, binned=None
+    ):
+        if self.per_type is True:
+            if test_types is None:
+                raise ValueError("test_types is required to train a model per type")
+            y_pred, y_oof, score = self._run_per_type(
+                X_train, y_train, X_test, test_types
+            )
+        else:
+            y_pred, y_oof, score = self._run(X_train, y_train, X_test, folds, binned)
+        print(f"Score: {score}")
+
+        if self.save is True:
+            self._save_predicted_feature(
+                y_pred, y_oof, X_train.index, X_test.index, score
+            )
+
+        return y_pred
+
+    def _run(
+        self, X_train, y_train, X_test, folds=None, binned=None, model_name=None
+    ):
         pt = ParameterTuning(self.config)
         if self.tuning is True:
-            params = pt.run(X_train, y_train)
+            params = pt.run(X_train, y_train, folds=folds, binned=binned)
         else:
             params = pt.get_best_params()
             if params is None:
                 params = {}
         del pt
+        params["n_jobs"] = self.budget.model_threads
 
-        kf = KFold(n_splits=self.n_splits, shuffle=True, random_state=self.seed)
+        # folds are index arrays so X is only sliced when fitting
+        if folds is None:
+            folds = get_folds(len(X_train), self.n_splits, self.seed)
+        if binned is None and self.binned_dataset is True:
+            binned = BinnedDataset(
+                X_train,
+                y_train[self.target_name],
+                cache_dir=self.binned_dataset_dir,
+                params=self.dataset_params,
+                cache=self.cache,
+            )
         score = []
-        y_pred = []
-        for train_idx, valid_idx in kf.split(X_train):
-            X_train_ = X_train.iloc[train_idx]
-            y_train_ = y_train.iloc[train_idx][self.target_name]
-            X_valid_ = X_train.iloc[valid_idx]
+        boosters = []
+        # out-of-fold predictions are the train values of predicted features
+        y_oof = np.full(len(X_train), np.nan)
+        for train_idx, valid_idx in folds:
             y_valid_ = y_train.iloc[valid_idx]
+            metric = GroupLogMAE(y_valid_["type"].values)
             model = LGBMRegressor(**params)
-            model.fit(
+            if binned is not None:
+                model.fit_dataset(
+                    binned.subset(train_idx),
+                    binned.subset(valid_idx),
+                    feval=metric.feval,
+                    early_stopping_rounds=3,
+                    verbose=500,
+                )
+            else:
+                model.fit(
+                    X_train.iloc[train_idx],
+                    y_train.iloc[train_idx][self.target_name],
+                    eval_set=(X_train.iloc[valid_idx], y_valid_[self.target_name]),
+                    eval_metric=metric.eval_metric,
+                    early_stopping_rounds=3,
+                    verbose=500,
+                )
+            # valid rows are predicted in batches instead of copied at once
+            predictor = FoldEnsemblePredictor(
+                [model], batch_size=self.predict_batch_size, n_threads=params["n_jobs"]
+            )
+            y_pred_ = predictor.predict(X_train, rows=valid_idx)
+            y_oof[valid_idx] = y_pred_
+            score.append(model.calculate_score(y_valid_, y_pred_, self.target_name))
+            boosters.append(model.booster_)
+            del y_valid_, model, predictor
+        del binned
+
+        if self.save_models is True:
+            registry = ModelRegistry(self.model_registry_dir, self.experiment_name)
+            registry.save(
+                model_name or self.target_name,
+                boosters,
+                X_train.columns,
+                params,
+                score,
+            )
+
+        y_pred = self.predict(boosters, X_test)
+        return y_pred, y_oof, np.mean(score)
+
+    def predict(self, models, X_test):
+        """ Fold-averaged predictions of fitted models or saved model files """
+        predictor = FoldEnsemblePredictor(
+            models,
+            batch_size=self.predict_batch_size,
+            n_workers=self.n_predict_workers,
+            n_threads=self.budget.get_threads(self.n_predict_workers),
+        )
+        return predictor.predict(X_test)
+
+    def _run_per_type(self, X_train, y_train, X_test, test_types):
+        # one model per coupling type, the types with most rows start first
+        train_types = y_train["type"].values
+        test_types = np.asarray(test_types)
+        codes, counts = np.unique(train_types, return_counts=True)
+        codes = codes[np.argsort(-counts, kind="stable")]
+        n_workers = max(1, min(self.n_type_workers, len(codes)))
+        budget = self.budget.split(n_workers)
+
+        def train(code):
+            label = TYPE_VOCAB.labels[code]
+            train_rows = np.flatnonzero(train_types == code)
+            test_rows = np.flatnonzero(test_types == code)
+            X_train_ = self._take_rows(X_train, train_rows, label)
+            prediction = SubTargetPrediction(self._get_type_config(label, budget))
+            y_pred_, y_oof_, score_ = prediction._run(
                 X_train_,
-                y_train_,
-                eval_set=(X_valid_, y_valid_[self.target_name]),
-                early_stopping_rounds=3,
-                verbose=500,
+                y_train.iloc[train_rows],
+                X_test.iloc[test_rows],
+                model_name=f"{self.target_name}/{label}",
             )
-            y_pred_ = model.predict(X_valid_)
-            score.append(model.calculate_score(y_valid_, y_pred_))
-            y_pred.append(model.predict(X_test))
-            del X_train_, y_train_, X_valid_, y_valid_, model
+            print(f"Score of {label}: {score_}")
+            return train_rows, test_rows, y_pred_, y_oof_, score_
 
-        print(f"Score: {np.mean(score)}")
-        y_pred = np.mean(y_pred, axis=0)
+        # lightgbm releases the GIL, so the types are trained on threads
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(train, codes))
 
-        if self.save is True:
-            self._save_predicted_feature(y_pred, X_test.index)
+        # stitch the predictions back in the order of X_train and X_test
+        y_pred = np.full(len(X_test), np.nan)
+        y_oof = np.full(len(X_train), np.nan)
+        score = []
+        for train_rows, test_rows, y_pred_, y_oof_, score_ in results:
+            y_pred[test_rows] = y_pred_
+            y_oof[train_rows] = y_oof_
+            score.append(score_)
+        return y_pred, y_oof, np.mean(score)
+
+    def _get_type_config(self, label, budget):
+        config = self.config.with_study_name(f"{self.config.study_name}_{label}")
+        config.per_type = False
+        config.budget = budget
+        return config
+
+    @staticmethod
+    def _take_rows(X, rows, label):
+        X_ = X.iloc[rows]
+        # the binned dataset of the rows of one type is cached under its own key
+        key = X.attrs.get("cache_key")
+        X_.attrs["cache_key"] = f"{key}/{label}" if key is not None else None
+        # the rows are a copy, not the memory-mapped file of X
+        X_.attrs.pop("memmap_path", None)
+        return X_
 
+    def _save_predicted_feature(self, y_pred, y_oof, train_index, test_index, score):
+        store = PredictionStore(self.prediction_store_dir, self.experiment_name)
+        version = store.put(
+            self.target_name,
+            {
+                "train": pd.DataFrame({self.target_name: y_oof}, index=train_index),
+                "test": pd.DataFrame({self.target_name: y_pred}, index=test_index),
+            },
+            score=float(score),
+        )
+        print(f"save {self.target_name} to prediction store (version {version})")
+
+
+class RegisteredPrediction:
+    """ Predictions of a sub-target by registered fold models without training """
+
+    def __init__(self, config):
+        self.target_name = config.target_name
+        self.per_type = config.per_type
+        self.budget = config.budget
+        self.predict_batch_size = config.predict_batch_size
+        self.n_predict_workers = config.n_predict_workers
+        self.registry = ModelRegistry(config.model_registry_dir, config.experiment_name)
+
+    def load(self, version=None):
+        """ Load the boosters of every registered model now, not when predicting """
+        names = [self.target_name]
+        if self.per_type is True:
+            names = [f"{self.target_name}/{label}" for label in TYPE_VOCAB.labels]
+        for name in names:
+            if self.registry.has(name, version):
+                self.registry.load(name, version).get_predictor().boosters
+
+    def run(self, X_test, test_types=None, version=None):
+        if self.per_type is not True:
+            return self._predict(self.target_name, X_test, version)
+
+        if test_types is None:
+            raise ValueError("test_types is required to predict with models per type")
+        test_types = np.asarray(test_types)
+        y_pred = np.full(len(X_test), np.nan)
+        for code in np.unique(test_types):
+            label = TYPE_VOCAB.labels[code]
+            rows = np.flatnonzero(test_types == code)
+            y_pred[rows] = self._predict(
+                f"{self.target_name}/{label}", X_test.iloc[rows], version
+            )
         return y_pred
 
-    def _save_predicted_feature(self, y_pred, index):
-        predicted_feature = pd.DataFrame(y_pred, index=index)
-        predicted_feature.columns = [self.target_name]
-        path = os.path.join(self.pickled_feature_dir, "test", f"{self.target_name}.pkl")
-        predicted_feature.to_pickle(path)
-        print(f"save {self.target_name} for test to pickle")
+    def _predict(self, name, X, version):
+        model = self.registry.load(name, version)
+        return model.predict(
+            X,
+            batch_size=self.predict_batch_size,
+            n_workers=self.n_predict_workers,
+            n_threads=self.budget.get_threads(self.n_predict_workers),
+        )
+
+
+class MultiTargetPrediction:
+    """ Sub-target models trained one after another on the same inputs
+
+    X, the fold indices and the binned dataset are made once, and only the
+    label of the binned dataset is replaced for each sub-target.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.target_names = config.target_names
+        self.n_splits = config.n_splits
+        self.seed = config.seed
+        self.per_type = config.per_type
+        self.binned_dataset = config.binned_dataset
+        self.binned_dataset_dir = config.binned_dataset_dir
+        self.cache = FeatureCache(config.feature_cache_dir, config.feature_cache_budget)
+        self.dataset_params = config.dataset_params
+
+    def run(self, X_train, y_train, X_test, test_types=None):
+        folds = None
+        binned = None
+        # models per type split the rows, so they make their own folds and bins
+        if self.per_type is not True:
+            folds = get_folds(len(X_train), self.n_splits, self.seed)
+            if self.binned_dataset is True:
+                binned = BinnedDataset(
+                    X_train,
+                    y_train[self.target_names[0]],
+                    cache_dir=self.binned_dataset_dir,
+                    params=self.dataset_params,
+                    cache=self.cache,
+                )
+
+        y_pred = {}
+        for target_name in self.target_names:
+            print("Target:", target_name)
+            if binned is not None:
+                binned.set_label(y_train[target_name])
+            prediction = SubTargetPrediction(self.config.for_target(target_name))
+            y_pred[target_name] = prediction.run(
+                X_train, y_train, X_test, test_types, folds=folds, binned=binned
+            )
+        del binned
+
+        return pd.DataFrame(y_pred, index=X_test.index)
 
 
 class TargetPrediction:
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+
+from .inference import FoldEnsemblePredictor
+from .versioning import VersionedDir
+
+
+class ModelRegistry:
+    """ Fold boosters of trained models saved with what is needed to reuse them
+
+    Each save makes a new version under experiment/name/v{version} with one
+    lightgbm model file per fold and a meta.json holding the feature names,
+    the parameters, the best iteration and score of each fold and the CV
+    score. A manifest of the name points to the latest version.
+    """
+
+    def __init__(self, registry_dir, experiment):
+        self.registry_dir = registry_dir
+        self.experiment = experiment
+        self.models = {}
+
+    def save(self, name, boosters, feature_names, params, scores):
+        cv_score = float(sum(scores) / len(scores))
+
+        def write(tmp_dir, version):
+            folds = []
+            for i, (booster, score) in enumerate(zip(boosters, scores)):
+                filename = f"fold_{i}.txt"
+                # trees after the best iteration are not saved
+                booster.save_model(os.path.join(tmp_dir, filename))
+                folds.append(
+                    {
+                        "filename": filename,
+                        "best_iteration": booster.best_iteration,
+                        "score": float(score),
+                    }
+                )
+            meta = {
+                "name": name,
+                "version": version,
+                "created": time.time(),
+                "feature_names": list(feature_names),
+                "params": {key: _to_json(val) for key, val in params.items()},
+                "folds": folds,
+                "cv_score": cv_score,
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+                json.dump(meta, f, indent=2)
+            return {"created": meta["created"], "cv_score": cv_score}
+
+        version = self._get_versions(name).add(write)
+        print(f"save {name} to model registry (version {version})")
+        return version
+
+    def has(self, name, version=None):
+        versions = self._get_versions(name)
+        version = versions.get_version(version)
+        if version is None:
+            return False
+        return os.path.isfile(os.path.join(versions.get_dir(version), "meta.json"))
+
+    def load(self, name, version=None):
+        """ RegisteredModel of a version (the latest by default) """
+        if not self.has(name, version):
+            raise ValueError("No model registered as {} v{}".format(name, version))
+        versions = self._get_versions(name)
+        version = versions.get_version(version)
+        if (name, version) not in self.models:
+            version_dir = versions.get_dir(version)
+            with open(os.path.join(version_dir, "meta.json")) as f:
+                meta = json.load(f)
+            self.models[(name, version)] = RegisteredModel(version_dir, meta)
+        return self.models[(name, version)]
+
+    def _get_versions(self, name):
+        return VersionedDir(os.path.join(self.registry_dir, self.experiment, name))
+
+
+class RegisteredModel:
+    """ Fold boosters of a registered model, loaded when first predicting """
+
+    def __init__(self, version_dir, meta):
+        self.version_dir = version_dir
+        self.meta = meta
+        self.predictor_ = None
+
+    @property
+    def feature_names(self):
+        return self.meta["feature_names"]
+
+    @property
+    def cv_score(self):
+        return self.meta["cv_score"]
+
+    def get_predictor(self, batch_size=100000, n_workers=1, n_threads=1):
+        if self.predictor_ is None:
+            paths = [
+                os.path.join(self.version_dir, fold["filename"])
+                for fold in self.meta["folds"]
+            ]
+            self.predictor_ = FoldEnsemblePredictor(paths)
+        self.predictor_.batch_size = batch_size
+        self.predictor_.n_workers = max(1, n_workers)
+        self.predictor_.n_threads = max(1, n_threads)
+        return self.predictor_
+
+    def predict(self, X, batch_size=100000, n_workers=1, n_threads=1):
+        if list(X.columns) != self.feature_names:
+            missing = [col for col in self.feature_names if col not in X.columns]
+            if missing:
+                raise ValueError("Features not found in X: {}".format(missing))
+            X = X[self.feature_names]
+        predictor = self.get_predictor(batch_size, n_workers, n_threads)
+        return predictor.predict(X)
+
+
+def _to_json(val):
+    # numpy scalars of parameters chosen by optuna
+    return val.item() if hasattr(val, "item") else val
@@ -1,21 +1,28 @@
 import numpy as np
-import pandas as pd
 from sklearn.preprocessing import LabelEncoder
 
+from .graph import AtomIndex
+
 
 class Preprocessing:
     def __call__(self, raw):
         return self.run(raw)
 
     def run(self, raw):
-        train = raw.train
-        test = raw.test
+        train = raw.train.copy()
+        test = raw.test.copy()
 
         # map information of atoms
-        train = self.map_atom_info(train, raw.structures, 0)
-        train = self.map_atom_info(train, raw.structures, 1)
-        test = self.map_atom_info(test, raw.structures, 0)
-        test = self.map_atom_info(test, raw.structures, 1)
+        structures = raw.structures.sort_values(
+            ["molecule_name", "atom_index"], kind="mergesort"
+        ).reset_index(drop=True)
+        atom_index = AtomIndex(
+            structures["molecule_name"].values, structures["atom_index"].values
+        )
+        train = self.map_atom_info(train, structures, 0, atom_index)
+        train = self.map_atom_info(train, structures, 1, atom_index)
+        test = self.map_atom_info(test, structures, 0, atom_index)
+        test = self.map_atom_info(test, structures, 1, atom_index)
 
         # add distance between two atoms
         train = self.add_distance(train)
@@ -39,23 +46,12 @@ class Preprocessing:
         return train, test
 
     @staticmethod
-    def map_atom_info(df, structures, index):
-        df = pd.merge(
-            df,
-            structures,
-            how="left",
-            left_on=["molecule_name", f"atom_index_{index}"],
-            right_on=["molecule_name", "atom_index"],
-        )
-        df = df.drop(columns="atom_index")
-        df = df.rename(
-            columns={
-                "atom": f"atom_{index}",
-                "x": f"x_{index}",
-                "y": f"y_{index}",
-                "z": f"z_{index}",
-            }
+    def map_atom_info(df, structures, index, atom_index):
+        rows = atom_index.get_rows(
+            df["molecule_name"].values, df[f"atom_index_{index}"].values
         )
+        for col in ["atom", "x", "y", "z"]:
+            df[f"{col}_{index}"] = atom_index.take(structures[col].array, rows)
         return df
 
     @staticmethod
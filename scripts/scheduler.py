@@ -0,0 +1,67 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# inputs shared with forked workers without pickling them per task
+_SHARED = {}
+
+
+def _compute_unit(i):
+    unit = _SHARED["units"][i]
+    return unit.compute(_SHARED["df"], _SHARED["dataset"], _SHARED["kind"])
+
+
+class FeatureScheduler:
+    """ Compute features on a pool of forked worker processes
+
+    The input table is inherited read-only by the workers, and features are
+    submitted level by level so that a feature runs only after the features
+    it depends on have finished.
+    """
+
+    def __init__(self, n_workers=1):
+        self.n_workers = n_workers
+
+    def run(self, units, df, dataset, kind):
+        """ Yield the results of each unit on df, the "train" or "test" table """
+        levels = self.get_levels(units)
+        if self.n_workers <= 1:
+            for level in levels:
+                for i in level:
+                    yield units[i].compute(df, dataset, kind)
+            return
+
+        _SHARED.update(units=units, df=df, dataset=dataset, kind=kind)
+        try:
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(self.n_workers, mp_context=context) as executor:
+                for level in levels:
+                    futures = [executor.submit(_compute_unit, i) for i in level]
+                    for future in as_completed(futures):
+                        yield future.result()
+        finally:
+            _SHARED.clear()
+
+    @staticmethod
+    def get_levels(units):
+        """ Indices of units grouped so that dependencies come first """
+        owner = {}
+        for i, unit in enumerate(units):
+            for name in unit.feature_names:
+                owner[name] = i
+
+        # dependencies outside of units are already computed
+        depends = [
+            {owner[name] for name in unit.depends_on if name in owner} - {i}
+            for i, unit in enumerate(units)
+        ]
+        levels = []
+        done = set()
+        while len(done) < len(units):
+            level = [
+                i for i in range(len(units)) if i not in done and depends[i] <= done
+            ]
+            if not level:
+                raise ValueError("Features have circular dependencies")
+            levels.append(level)
+            done.update(level)
+        return levels
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+MOLECULE_PREFIX = "dsgdb9nsd_"
+
+
+class Vocabulary:
+    """ Mapping between string labels and small integer codes """
+
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self.categorical_dtype = pd.CategoricalDtype(self.labels)
+        # dtype of the codes of categoricals of the labels (e.g. int8)
+        self.codes_dtype = pd.Categorical([], dtype=self.categorical_dtype).codes.dtype
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __repr__(self):
+        return f"Vocabulary({self.labels!r})"
+
+    def encode(self, values):
+        """ Codes of values (-1 for unknown labels) """
+        codes = self.categorical_dtype.categories.get_indexer(values)
+        return codes.astype(self.codes_dtype)
+
+
+TYPE_VOCAB = Vocabulary(
+    ["1JHC", "1JHN", "2JHC", "2JHH", "2JHN", "3JHC", "3JHH", "3JHN"]
+)
+TYPE_0_VOCAB = Vocabulary(["1", "2", "3"])
+ATOM_VOCAB = Vocabulary(["C", "F", "H", "N", "O"])
+
+# type_0 code of each type code
+TYPE_TO_TYPE_0 = TYPE_0_VOCAB.encode([label[0] for label in TYPE_VOCAB.labels])
+
+# placeholder dtype of molecule names converted to int32 ids
+MOLECULE_ID = "molecule_id"
+
+# dtypes of raw csv files
+TRAIN_SCHEMA = {
+    "id": np.int32,
+    "molecule_name": MOLECULE_ID,
+    "atom_index_0": np.int16,
+    "atom_index_1": np.int16,
+    "type": TYPE_VOCAB,
+    "scalar_coupling_constant": np.float32,
+}
+
+TEST_SCHEMA = {
+    "id": np.int32,
+    "molecule_name": MOLECULE_ID,
+    "atom_index_0": np.int16,
+    "atom_index_1": np.int16,
+    "type": TYPE_VOCAB,
+}
+
+STRUCTURES_SCHEMA = {
+    "molecule_name": MOLECULE_ID,
+    "atom_index": np.int16,
+    "atom": ATOM_VOCAB,
+    "x": np.float32,
+    "y": np.float32,
+    "z": np.float32,
+}
+
+SCALAR_COUPLING_CONTRIBUTIONS_SCHEMA = {
+    "molecule_name": MOLECULE_ID,
+    "atom_index_0": np.int16,
+    "atom_index_1": np.int16,
+    "type": TYPE_VOCAB,
+    "fc": np.float32,
+    "sd": np.float32,
+    "pso": np.float32,
+    "dso": np.float32,
+}
+
+DIPOLE_MOMENTS_SCHEMA = {
+    "molecule_name": MOLECULE_ID,
+    "X": np.float32,
+    "Y": np.float32,
+    "Z": np.float32,
+}
+
+MAGNETIC_SHIELDING_TENSORS_SCHEMA = {
+    "molecule_name": MOLECULE_ID,
+    "atom_index": np.int16,
+    "XX": np.float32,
+    "YX": np.float32,
+    "ZX": np.float32,
+    "XY": np.float32,
+    "YY": np.float32,
+    "ZY": np.float32,
+    "XZ": np.float32,
+    "YZ": np.float32,
+    "ZZ": np.float32,
+}
+
+MULLIKEN_CHARGES_SCHEMA = {
+    "molecule_name": MOLECULE_ID,
+    "atom_index": np.int16,
+    "mulliken_charge": np.float32,
+}
+
+POTENTIAL_ENERGY_SCHEMA = {
+    "molecule_name": MOLECULE_ID,
+    "potential_energy": np.float32,
+}
+
+
+def encode_molecule_names(names):
+    return names.str.slice(start=len(MOLECULE_PREFIX)).astype(np.int32)
+
+
+def get_type_0(type_codes):
+    return TYPE_TO_TYPE_0[np.asarray(type_codes)]
+
+
+def get_read_dtypes(schema):
+    dtypes = {}
+    for col, dtype in schema.items():
+        if _is_molecule_id(dtype):
+            dtypes[col] = object
+        elif isinstance(dtype, Vocabulary):
+            dtypes[col] = dtype.categorical_dtype
+        else:
+            dtypes[col] = dtype
+    return dtypes
+
+
+def apply_schema(chunk, schema):
+    for col, dtype in schema.items():
+        if _is_molecule_id(dtype):
+            chunk[col] = encode_molecule_names(chunk[col])
+        elif isinstance(dtype, Vocabulary):
+            chunk[col] = chunk[col].cat.codes
+    return chunk
+
+
+def _is_molecule_id(dtype):
+    return isinstance(dtype, str) and dtype == MOLECULE_ID
@@ -0,0 +1,264 @@
+import json
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from .config import Config
+from .feature import FeatureFactory, PredictedFeature
+from .matrix import FeatureMatrixBuilder
+from .predict import RegisteredPrediction
+from .preprocess import Preprocessor
+from .scheduler import FeatureScheduler
+from .schema import ATOM_VOCAB, TYPE_VOCAB
+from .utility import apply_dtypes, widen_dtypes, DtypeSchemaStore
+
+Dataset = namedtuple("Dataset", ["train", "test", "structures", "bonds"])
+
+# methane with two of its pairs, featurized at startup to check the features
+PROBE_MOLECULE = {
+    "atoms": ["C", "H", "H", "H", "H"],
+    "coordinates": [
+        [0.0, 0.0, 0.0],
+        [0.629, 0.629, 0.629],
+        [-0.629, -0.629, 0.629],
+        [-0.629, 0.629, -0.629],
+        [0.629, -0.629, -0.629],
+    ],
+    "pairs": [[1, 0, "1JHC"], [1, 2, "2JHH"]],
+}
+
+
+class MoleculeScorer:
+    """ Predictions of registered models for molecules given by coordinates
+
+    The molecules of a batch are numbered 0, 1, 2, ... and preprocessed and
+    featurized together, which gives the same values as one at a time since
+    every feature is computed within a molecule.
+    """
+
+    def __init__(self, config):
+        ff = FeatureFactory()
+        self.feature_names = config.feature_names
+        self.features = [ff(name) for name in self.feature_names]
+        for feature in self.features:
+            if isinstance(feature, PredictedFeature):
+                raise ValueError(
+                    f"{feature.__class__.__name__} needs predictions of the batch "
+                    "pipeline and cannot be served"
+                )
+        self.units = ff.fuse(self.features)
+        self.dtype_store = DtypeSchemaStore(config.dtype_schema_path)
+        self.float_policy = config.float_policy
+        self.preprocessor = Preprocessor()
+        self._check_features()
+        self.prediction = RegisteredPrediction(config)
+        self.prediction.load()
+
+    def score(self, molecules):
+        """ Predictions of the atom pairs of each molecule """
+        test, dataset = self._preprocess(molecules)
+        X = self._make_X(test, dataset)
+        y_pred = self.prediction.run(X, test_types=test["type"].values)
+        sizes = [len(molecule["pairs"]) for molecule in molecules]
+        return [y.tolist() for y in np.split(y_pred, np.cumsum(sizes)[:-1])]
+
+    @staticmethod
+    def check(molecule):
+        """ Raise ValueError if the molecule cannot be scored
+
+        A molecule is {"atoms": ["C", "H", ...], "coordinates": [[x, y, z],
+        ...], "pairs": [[atom_index_0, atom_index_1, type], ...]}.
+        """
+        try:
+            atoms = ATOM_VOCAB.encode(molecule["atoms"])
+            coordinates = np.asarray(molecule["coordinates"], dtype=np.float64)
+            pairs = molecule["pairs"]
+            types = TYPE_VOCAB.encode([pair[2] for pair in pairs])
+            index = np.asarray([pair[:2] for pair in pairs], dtype=np.int64)
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"malformed molecule: {e!r}")
+        if np.any(atoms < 0):
+            raise ValueError(f"unknown atoms in {molecule['atoms']}")
+        if coordinates.shape != (len(atoms), 3):
+            raise ValueError("coordinates have to be one [x, y, z] per atom")
+        if len(pairs) == 0:
+            raise ValueError("no atom pairs to score")
+        if np.any(types < 0):
+            raise ValueError(f"unknown types in {[pair[2] for pair in pairs]}")
+        if np.any(index < 0) or np.any(index >= len(atoms)):
+            raise ValueError("atom index of pairs out of range")
+
+    def _check_features(self):
+        """ Raise ValueError if the features cannot be computed from requests """
+        test, dataset = self._preprocess([PROBE_MOLECULE])
+        columns = set(test.columns) | set(test.index.names)
+        missing = [
+            col
+            for col in FeatureFactory().required_columns(self.feature_names)
+            if col not in columns
+        ]
+        if missing:
+            raise ValueError(f"Columns used by features are not served: {missing}")
+        self._make_X(test, dataset)
+
+    def _preprocess(self, molecules):
+        structures, test = self._make_tables(molecules)
+        structures, bonds = self.preprocessor.preprocess_structures(structures)
+        test = self.preprocessor.preprocess_test(test, structures)
+        dataset = Dataset(None, test, structures.set_index("molecule_name"), bonds)
+        return test, dataset
+
+    def _make_tables(self, molecules):
+        structures = []
+        test = []
+        n_pairs = 0
+        for i, molecule in enumerate(molecules):
+            coordinates = np.asarray(molecule["coordinates"], dtype=np.float32)
+            n_atoms = len(coordinates)
+            structures.append(
+                pd.DataFrame(
+                    {
+                        "molecule_name": np.full(n_atoms, i, dtype=np.int32),
+                        "atom_index": np.arange(n_atoms, dtype=np.int16),
+                        "atom": ATOM_VOCAB.encode(molecule["atoms"]),
+                        "x": coordinates[:, 0],
+                        "y": coordinates[:, 1],
+                        "z": coordinates[:, 2],
+                    }
+                )
+            )
+            pairs = molecule["pairs"]
+            test.append(
+                pd.DataFrame(
+                    {
+                        # ids of pairs are counted by the count features
+                        "id": np.arange(n_pairs, n_pairs + len(pairs), dtype=np.int32),
+                        "molecule_name": np.full(len(pairs), i, dtype=np.int32),
+                        "atom_index_0": np.array([p[0] for p in pairs], np.int16),
+                        "atom_index_1": np.array([p[1] for p in pairs], np.int16),
+                        "type": TYPE_VOCAB.encode([p[2] for p in pairs]),
+                    }
+                )
+            )
+            n_pairs += len(pairs)
+        return (
+            pd.concat(structures, ignore_index=True),
+            pd.concat(test, ignore_index=True),
+        )
+
+    def _make_X(self, df, dataset):
+        builder = FeatureMatrixBuilder(df.index)
+        builder.allocate(
+            [(f.__class__.__name__, f.get_column_names(df)) for f in self.features]
+        )
+        for results in FeatureScheduler(1).run(self.units, df, dataset, "test"):
+            for _name, values in results.items():
+                # the dtypes of the batch pipeline give the same rounding
+                schema = widen_dtypes(
+                    values, self.dtype_store.get(_name) or {}, self.float_policy
+                )
+                builder.write(_name, apply_dtypes(values, schema))
+        return builder.build()
+
+
+class MicroBatcher:
+    """ Score the molecules of concurrent requests together
+
+    The first molecule of a batch waits at most max_wait seconds for others,
+    and up to max_batch_size molecules are scored in one call.
+    """
+
+    def __init__(self, scorer, max_batch_size=64, max_wait=0.005):
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, molecule):
+        self.scorer.check(molecule)
+        future = Future()
+        self.queue.put((molecule, future))
+        return future
+
+    def _loop(self):
+        while True:
+            items = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                results = self.scorer.score([molecule for molecule, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(items, results):
+                future.set_result(result)
+
+
+def serve(config=None):
+    """ Serve POST /predict on HTTP until interrupted
+
+    The body is a molecule (see MoleculeScorer.check) or {"molecules": [...]},
+    and the response is {"predictions": [[value of each pair], ...]}.
+    """
+    config = config or Config()
+    scorer = MoleculeScorer(config)
+    batcher = MicroBatcher(
+        scorer, config.service_max_batch_size, config.service_max_wait
+    )
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send(404, {"error": f"not found: {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length))
+                molecules = body["molecules"] if "molecules" in body else [body]
+                futures = [batcher.submit(molecule) for molecule in molecules]
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            try:
+                predictions = [future.result() for future in futures]
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+                return
+            self._send(200, {"predictions": predictions})
+
+        def _send(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((config.service_host, config.service_port), Handler)
+    print(
+        f"serve {config.target_name} on "
+        f"http://{config.service_host}:{config.service_port}/predict"
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
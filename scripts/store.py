@@ -0,0 +1,72 @@
+import os
+import time
+
+import pyarrow.feather as feather
+
+from .versioning import VersionedDir
+
+
+class PredictionStore:
+    """ Versioned predictions of sub-targets stored as feather files
+
+    Predictions are kept under experiment/target/v{version}/{kind}.feather,
+    where kind is "train" (out-of-fold predictions) or "test". Each put makes
+    a new version, and a manifest of the target points to the latest one.
+    Files are written without compression so that they can be read
+    memory-mapped, one column at a time.
+    """
+
+    def __init__(self, store_dir, experiment):
+        self.store_dir = store_dir
+        self.experiment = experiment
+
+    def put(self, target, predictions, score=None):
+        """ Save a new version from {kind: DataFrame of target} """
+
+        def write(tmp_dir, version):
+            entry = {"created": time.time(), "score": score, "kinds": {}}
+            for kind, df in predictions.items():
+                index_names = [name for name in df.index.names if name is not None]
+                table = df.reset_index() if index_names else df
+                feather.write_feather(
+                    table,
+                    os.path.join(tmp_dir, f"{kind}.feather"),
+                    compression="uncompressed",
+                )
+                entry["kinds"][kind] = {"index": index_names, "n_rows": len(df)}
+            return entry
+
+        return self._get_versions(target).add(write)
+
+    def has(self, target, kind, version=None):
+        version = self.get_version(target, version)
+        if version is None:
+            return False
+        return os.path.isfile(self._get_path(target, kind, version))
+
+    def get(self, target, kind, columns=None, version=None):
+        """ Predictions of a version (the latest by default) or None """
+        version = self.get_version(target, version)
+        if version is None or not self.has(target, kind, version):
+            return None
+        entry = self._get_versions(target).get_entry(version)
+        index_names = entry["kinds"][kind]["index"]
+        if columns is not None:
+            columns = index_names + [col for col in columns if col not in index_names]
+        table = feather.read_table(
+            self._get_path(target, kind, version), columns=columns, memory_map=True
+        )
+        df = table.to_pandas()
+        if index_names:
+            df = df.set_index(index_names)
+        return df
+
+    def get_version(self, target, version=None):
+        return self._get_versions(target).get_version(version)
+
+    def _get_versions(self, target):
+        return VersionedDir(os.path.join(self.store_dir, self.experiment, target))
+
+    def _get_path(self, target, kind, version):
+        version_dir = self._get_versions(target).get_dir(version)
+        return os.path.join(version_dir, f"{kind}.feather")
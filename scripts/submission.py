@@ -1,3 +1,6 @@
+import numpy as np
+import pandas as pd
+
 from .config import Config
 from .db import LocalFile
 
@@ -7,8 +10,17 @@ class Submission:
         self.config = Config()
         self.save_path = self.config.submission_path
 
-    def save(self, prediction):
+    def save(self, prediction, ids):
+        """ Write the predictions of the test pairs with the given ids
+
+        Predictions are matched to the rows of the sample submission by id,
+        since preprocessed test rows are not in the order of the csv file.
+        """
         db = LocalFile(self.config)
         self.submission = db.get_submission()
-        self.submission["scalar_coupling_constant"] = prediction
+        prediction = pd.Series(np.asarray(prediction), index=np.asarray(ids))
+        prediction = prediction.reindex(self.submission["id"].values)
+        if prediction.isna().any():
+            raise ValueError(f"No predictions of {prediction.isna().sum()} test ids")
+        self.submission["scalar_coupling_constant"] = prediction.values
         self.submission.to_csv(self.save_path, index=False)
@@ -1,66 +1,267 @@
+import multiprocessing
 import os
 
 import numpy as np
 import optuna
-from sklearn.model_selection import KFold
 
-from .model import LGBMRegressor
+from .cache import FeatureCache
+from .inference import FoldEnsemblePredictor
+from .matrix import MemmapMatrix
+from .model import LGBMRegressor, BinnedDataset
+from .metric import GroupLogMAE
+from .utility import get_folds
+
+
+def get_pruner(name, **kwargs):
+    if name is None:
+        return optuna.pruners.NopPruner()
+    elif name == "median":
+        return optuna.pruners.MedianPruner(**kwargs)
+    elif name == "successive_halving":
+        return optuna.pruners.SuccessiveHalvingPruner(**kwargs)
+    elif name == "hyperband":
+        return optuna.pruners.HyperbandPruner(**kwargs)
+    else:
+        raise ValueError("No pruner named with {}".format(name))
+
+
+def get_journal_storage(path):
+    # appends of trials are small writes to one file, so many local worker
+    # processes do not wait on the write lock of a sqlite database
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    return optuna.storages.JournalStorage(optuna.storages.JournalFileStorage(path))
+
+
+def migrate_sqlite_studies(database_dir):
+    """ Copy every study in the sqlite databases of database_dir to journals """
+    for name in sorted(os.listdir(database_dir)):
+        if not name.endswith(".db"):
+            continue
+        sqlite_url = f"sqlite:///{os.path.join(database_dir, name)}"
+        for summary in optuna.get_all_study_summaries(storage=sqlite_url):
+            journal_path = os.path.join(database_dir, f"{summary.study_name}.log")
+            if os.path.isfile(journal_path):
+                continue
+            optuna.copy_study(
+                from_study_name=summary.study_name,
+                from_storage=sqlite_url,
+                to_storage=get_journal_storage(journal_path),
+            )
+            print(f"migrate {summary.study_name} to {journal_path}")
+
+
+class PruningCallback:
+    """ LightGBM callback reporting the validation metric to an optuna trial
+
+    Steps are offset by fold so that the iterations of the same fold are
+    compared across trials.
+    """
+
+    def __init__(self, trial, step_offset, metric_name, valid_name="valid_0"):
+        self.trial = trial
+        self.step_offset = step_offset
+        self.metric_name = metric_name
+        self.valid_name = valid_name
+
+    def __call__(self, env):
+        for valid_name, metric_name, value, _ in env.evaluation_result_list:
+            if valid_name != self.valid_name or metric_name != self.metric_name:
+                continue
+            self.trial.report(value, self.step_offset + env.iteration)
+            if self.trial.should_prune():
+                raise optuna.TrialPruned(f"Pruned at iteration {env.iteration}")
 
 
 class ParameterTuning:
     def __init__(self, config):
         self.target_name = config.target_name
         self.study_name = config.study_name
+        self.storage_type = config.storage_type
         self.storage_path = config.storage_path
+        self.journal_path = config.journal_path
         self.fixed_params = config.fixed_params
         self.param_space = config.param_space
         self.n_trials = config.n_trials
         self.n_splits = config.n_splits
         self.seed = config.seed
+        self.binned_dataset = config.binned_dataset
+        self.binned_dataset_dir = config.binned_dataset_dir
+        self.cache = FeatureCache(config.feature_cache_dir, config.feature_cache_budget)
+        self.dataset_params = config.dataset_params
+        self.predict_batch_size = config.predict_batch_size
+        self.pruner = config.pruner
+        self.pruner_params = config.pruner_params.get(config.pruner) or {}
+        self.prune_by = config.prune_by
+        self.budget = config.budget
+
+    def run(self, X, y, folds=None, binned=None):
+        # the same fold indices are shared by all trials
+        if folds is None:
+            folds = get_folds(len(X), self.n_splits, self.seed)
+
+        self.migrate_storage()
+        study = optuna.create_study(
+            study_name=self.study_name,
+            storage=self._get_storage(),
+            load_if_exists=True,
+            pruner=get_pruner(self.pruner, **self.pruner_params),
+        )
+
+        # search the best parameters with optuna
+        n_workers = self.budget.n_trial_workers
+        if self.budget.backend == "process" and n_workers > 1:
+            self._optimize_in_processes(X, y, folds, n_workers)
+        else:
+            if binned is None:
+                binned = self._get_binned(X, y)
+            objective = self._get_objective(X, y, folds, binned)
+            study.optimize(objective, n_trials=self.n_trials, n_jobs=n_workers)
+
+        # get the best parameters
+        best_params = study.best_params
+        best_params.update(self.fixed_params)
+        return best_params
+
+    def _get_binned(self, X, y):
+        # bins are built once and shared by all trials and folds
+        if self.binned_dataset is not True:
+            return None
+        return BinnedDataset(
+            X,
+            y[self.target_name],
+            cache_dir=self.binned_dataset_dir,
+            params=self.dataset_params,
+            cache=self.cache,
+        )
+
+    def _get_objective(self, X, y, folds, binned):
+        metric_name = GroupLogMAE.name
 
-    def run(self, X, y):
         def objective(trial):
             params = {key: space(trial) for key, space in self.param_space.items()}
             params.update(self.fixed_params)
+            params["n_jobs"] = self.budget.trial_threads
             model = LGBMRegressor(**params)
-            kf = KFold(n_splits=self.n_splits, shuffle=True, random_state=self.seed)
             score = []
-            for train_idx, valid_idx in kf.split(X):
-                X_train_ = X.iloc[train_idx]
-                y_train_ = y.iloc[train_idx][self.target_name]
-                X_valid_ = X.iloc[valid_idx]
+            for fold, (train_idx, valid_idx) in enumerate(folds):
+                callbacks = None
+                if self.prune_by == "iteration":
+                    # steps of each fold follow those of the previous folds
+                    step_offset = fold * model.n_estimators
+                    callbacks = [PruningCallback(trial, step_offset, metric_name)]
                 y_valid_ = y.iloc[valid_idx]
-                model.fit(
-                    X_train_,
-                    y_train_,
-                    eval_set=(X_valid_, y_valid_[self.target_name]),
-                    early_stopping_rounds=3,
-                    verbose=False,
+                metric = GroupLogMAE(y_valid_["type"].values)
+                if binned is not None:
+                    # subsets are made per trial since training updates them
+                    model.fit_dataset(
+                        binned.subset(train_idx),
+                        binned.subset(valid_idx),
+                        feval=metric.feval,
+                        early_stopping_rounds=3,
+                        verbose=False,
+                        callbacks=callbacks,
+                    )
+                else:
+                    model.fit(
+                        X.iloc[train_idx],
+                        y.iloc[train_idx][self.target_name],
+                        eval_set=(X.iloc[valid_idx], y_valid_[self.target_name]),
+                        eval_metric=metric.eval_metric,
+                        early_stopping_rounds=3,
+                        verbose=False,
+                        callbacks=callbacks,
+                    )
+                # valid rows are predicted in batches instead of copied at once
+                predictor = FoldEnsemblePredictor(
+                    [model],
+                    batch_size=self.predict_batch_size,
+                    n_threads=params["n_jobs"],
                 )
-                y_pred_ = model.predict(X_valid_)
-                score.append(model.calculate_score(y_valid_, y_pred_))
+                y_pred_ = predictor.predict(X, rows=valid_idx)
+                score.append(model.calculate_score(y_valid_, y_pred_, self.target_name))
+                if self.prune_by == "fold":
+                    trial.report(np.mean(score), fold)
+                    if trial.should_prune():
+                        raise optuna.TrialPruned(f"Pruned after fold {fold}")
             score = np.mean(score)
             return score
 
-        study = optuna.create_study(
-            study_name=self.study_name,
-            storage=f"sqlite:///{self.storage_path}",
-            load_if_exists=True,
+        return objective
+
+    def migrate_storage(self):
+        """ Copy the study from the sqlite database to the journal file once """
+        if self.storage_type != "journal" or os.path.isfile(self.journal_path):
+            return
+        if not os.path.isfile(self.storage_path):
+            return
+        optuna.copy_study(
+            from_study_name=self.study_name,
+            from_storage=f"sqlite:///{self.storage_path}",
+            to_storage=self._get_storage(),
         )
+        print(f"migrate {self.study_name} from {self.storage_path}")
 
-        # search the best parameters with optuna
-        study.optimize(objective, n_trials=self.n_trials, n_jobs=-1)
+    def _get_storage(self):
+        if self.storage_type == "journal":
+            return get_journal_storage(self.journal_path)
+        elif self.storage_type == "sqlite":
+            return f"sqlite:///{self.storage_path}"
+        else:
+            raise ValueError("No storage type named with {}".format(self.storage_type))
 
-        # get the best parameters
-        best_params = study.best_params
-        best_params.update(self.fixed_params)
-        return best_params
+    def _get_storage_file(self):
+        if self.storage_type == "journal":
+            return self.journal_path
+        return self.storage_path
+
+    def _optimize_in_processes(self, X, y, folds, n_workers):
+        # workers are spawned since forking after lightgbm used OpenMP (to bin
+        # X or to train a previous target) can hang, and each of them bins X
+        # on its own (or loads the saved bins). A memory-mapped X is opened
+        # by path instead of being copied to every worker.
+        context = multiprocessing.get_context("spawn")
+        X_source = X.attrs.get("memmap_path", X)
+        n_trials = [
+            self.n_trials // n_workers + (i < self.n_trials % n_workers)
+            for i in range(n_workers)
+        ]
+        workers = [
+            context.Process(
+                target=self._optimize_worker,
+                args=(X_source, dict(X.attrs), y, folds, n),
+            )
+            for n in n_trials
+            if n > 0
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        failed = [worker.exitcode for worker in workers if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"{len(failed)} tuning workers failed")
+
+    def _optimize_worker(self, X, attrs, y, folds, n_trials):
+        if isinstance(X, str):
+            X = MemmapMatrix(X).load()
+        X.attrs.update(attrs)
+        objective = self._get_objective(X, y, folds, self._get_binned(X, y))
+        # each process connects to the storage on its own
+        study = optuna.load_study(
+            study_name=self.study_name,
+            storage=self._get_storage(),
+            pruner=get_pruner(self.pruner, **self.pruner_params),
+        )
+        study.optimize(objective, n_trials=n_trials, n_jobs=1)
 
     def get_best_params(self):
-        if os.path.isfile(self.storage_path):
+        self.migrate_storage()
+        if os.path.isfile(self._get_storage_file()):
             study = optuna.create_study(
                 study_name=self.study_name,
-                storage=f"sqlite:///{self.storage_path}",
+                storage=self._get_storage(),
                 load_if_exists=True,
             )
             print("load the best parameters")
@@ -1,49 +1,177 @@
+import json
+import os
+
 import numpy as np
+import pandas as pd
+from sklearn.model_selection import KFold
 
 
-def reduce_mem_usage(df, name="target", verbose=True):
+def reduce_mem_usage(
+    df, name="target", verbose=True, float_policy="float32", store=None
+):
     if verbose:
         start_mem = df.memory_usage().sum() / 1024 ** 2
 
-    numerics = ["int16", "int32", "int64", "float16", "float32", "float64"]
-
-    for col in df.columns:
-        col_type = df[col].dtypes
-        if col_type in numerics:
-            c_min = df[col].min()
-            c_max = df[col].max()
-            if str(col_type)[:3] == "int":
-                if c_min > np.iinfo(np.int8).min and c_max < np.iinfo(np.int8).max:
-                    df[col] = df[col].astype(np.int8)
-                elif c_min > np.iinfo(np.int16).min and c_max < np.iinfo(np.int16).max:
-                    df[col] = df[col].astype(np.int16)
-                elif c_min > np.iinfo(np.int32).min and c_max < np.iinfo(np.int32).max:
-                    df[col] = df[col].astype(np.int32)
-                elif c_min > np.iinfo(np.int64).min and c_max < np.iinfo(np.int64).max:
-                    df[col] = df[col].astype(np.int64)
-            else:
-                c_prec = df[col].apply(lambda x: np.finfo(x).precision).max()
-                if (
-                    c_min > np.finfo(np.float16).min
-                    and c_max < np.finfo(np.float16).max
-                    and c_prec == np.finfo(np.float16).precision
-                ):
-                    df[col] = df[col].astype(np.float16)
-                elif (
-                    c_min > np.finfo(np.float32).min
-                    and c_max < np.finfo(np.float32).max
-                    and c_prec == np.finfo(np.float32).precision
-                ):
-                    df[col] = df[col].astype(np.float32)
-                else:
-                    df[col] = df[col].astype(np.float64)
+    # reuse the schema planned in a previous run if every column is covered,
+    # widening it where the values do not fit (it is shared by train and test)
+    stored = store.get(name) if store is not None else None
+    if stored is None or not set(stored).issuperset(
+        df.select_dtypes(include="number").columns
+    ):
+        schema = plan_dtypes(df, float_policy)
+        if stored is not None:
+            schema = {
+                col: _get_wider_dtype(dtype, stored.get(col))
+                for col, dtype in schema.items()
+            }
+    else:
+        schema = widen_dtypes(df, stored, float_policy)
+    if store is not None and schema != stored:
+        store.set(name, schema)
+    df = apply_dtypes(df, schema)
 
     if verbose:
         end_mem = df.memory_usage().sum() / 1024 ** 2
-        reduction_rate = 100 * (start_mem - end_mem) / start_mem
+        reduction_rate = 100 * (start_mem - end_mem) / start_mem if start_mem else 0.0
         print(
             "Memory usage of {} decreased to {:5.2f} Mb ({:.1f}% reduction)".format(
                 name, end_mem, reduction_rate
             )
         )
     return df
+
+
+def get_folds(n_samples, n_splits, seed):
+    """ (train indices, valid indices) of each fold, computed once per run """
+    kf = KFold(n_splits=n_splits, shuffle=True, random_state=seed)
+    return list(kf.split(np.zeros((n_samples, 1))))
+
+
+def plan_dtypes(df, float_policy="float32"):
+    """ Choose the smallest dtype of each numeric column from its min and max
+
+    float_policy is one of "keep", "float16", "float32" and "float64".
+    "keep" leaves float columns as they are, otherwise the column is cast to
+    the given float type if its range fits in it.
+    """
+    numerics = df.select_dtypes(include="number")
+    if numerics.shape[1] == 0:
+        return {}
+    c_min = numerics.min()
+    c_max = numerics.max()
+
+    schema = {}
+    for col, col_type in numerics.dtypes.items():
+        if col_type.kind in "iu":
+            schema[col] = _get_int_dtype(c_min[col], c_max[col])
+        else:
+            schema[col] = _get_float_dtype(
+                col_type, c_min[col], c_max[col], float_policy
+            )
+    return schema
+
+
+def widen_dtypes(df, schema, float_policy="float32"):
+    """ Schema with the dtypes of columns of df overflowing it widened """
+    numerics = df.select_dtypes(include="number")
+    columns = [col for col in numerics.columns if col in schema]
+    if not columns:
+        return schema
+    c_min = numerics[columns].min()
+    c_max = numerics[columns].max()
+    overflow = [
+        col
+        for col in columns
+        if not _fits_dtype(
+            np.dtype(schema[col]), numerics[col].dtype, c_min[col], c_max[col]
+        )
+    ]
+    if not overflow:
+        return schema
+    planned = plan_dtypes(numerics[overflow], float_policy)
+    schema = dict(schema)
+    for col in overflow:
+        schema[col] = _get_wider_dtype(planned[col], schema[col])
+    return schema
+
+
+def apply_dtypes(df, schema):
+    dtypes = {
+        col: dtype
+        for col, dtype in schema.items()
+        if col in df.columns and df[col].dtype != dtype
+    }
+    if dtypes:
+        df = df.astype(dtypes)
+    return df
+
+
+def _get_int_dtype(c_min, c_max):
+    for int_type in [np.int8, np.int16, np.int32]:
+        if c_min > np.iinfo(int_type).min and c_max < np.iinfo(int_type).max:
+            return np.dtype(int_type).name
+    return "int64"
+
+
+def _fits_dtype(dtype, col_type, c_min, c_max):
+    if pd.isna(c_min) or pd.isna(c_max):
+        return True
+    if dtype.kind in "iu":
+        if col_type.kind not in "iu":
+            return False
+        return c_min > np.iinfo(dtype).min and c_max < np.iinfo(dtype).max
+    if dtype.kind == "f":
+        return c_min > np.finfo(dtype).min and c_max < np.finfo(dtype).max
+    return True
+
+
+def _get_wider_dtype(dtype, other):
+    if other is None:
+        return np.dtype(dtype).name
+    return np.promote_types(dtype, other).name
+
+
+def _get_float_dtype(col_type, c_min, c_max, float_policy):
+    if float_policy == "keep":
+        return col_type.name
+    if float_policy not in ["float16", "float32", "float64"]:
+        raise ValueError("Unknown float policy: {}".format(float_policy))
+    if col_type.itemsize <= np.dtype(float_policy).itemsize:
+        return col_type.name
+    for float_type in [np.float16, np.float32]:
+        if np.dtype(float_type).itemsize < np.dtype(float_policy).itemsize:
+            continue
+        if c_min > np.finfo(float_type).min and c_max < np.finfo(float_type).max:
+            return np.dtype(float_type).name
+    return "float64"
+
+
+class DtypeSchemaStore:
+    """ Dtype schemas planned by reduce_mem_usage, persisted as json """
+
+    def __init__(self, path):
+        self.path = path
+        self.schemas = None
+
+    def get(self, name):
+        return self._load().get(name)
+
+    def set(self, name, schema):
+        schemas = self._load()
+        schemas[name] = {col: str(dtype) for col, dtype in schema.items()}
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(schemas, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if self.schemas is None:
+            if os.path.isfile(self.path):
+                with open(self.path) as f:
+                    self.schemas = json.load(f)
+            else:
+                self.schemas = {}
+        return self.schemas
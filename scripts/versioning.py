@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+
+
+class VersionedDir:
+    """ Versions of files saved under root/v{version}
+
+    A manifest.json in root keeps an entry of each version and points to the
+    latest one. Files of a version are written to a temporary directory which
+    is renamed when complete, so a version appears only after all of its
+    files are written.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+
+    def add(self, write):
+        """ Save a new version of the files written by write(tmp_dir, version)
+
+        write returns the entry of the version kept in the manifest.
+        """
+        manifest = self.load_manifest()
+        version = manifest["latest"] + 1
+
+        tmp_dir = os.path.join(self.root, f"v{version}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        entry = write(tmp_dir, version)
+        os.replace(tmp_dir, self.get_dir(version))
+
+        manifest["latest"] = version
+        manifest["versions"][str(version)] = entry
+        self.save_manifest(manifest)
+        return version
+
+    def get_version(self, version=None):
+        """ The given version (the latest by default) or None if not saved """
+        manifest = self.load_manifest()
+        if version is None:
+            version = manifest["latest"]
+        if str(version) not in manifest["versions"]:
+            return None
+        return version
+
+    def get_entry(self, version):
+        return self.load_manifest()["versions"][str(version)]
+
+    def get_dir(self, version):
+        return os.path.join(self.root, f"v{version}")
+
+    def load_manifest(self):
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        return {"latest": 0, "versions": {}}
+
+    def save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+from scripts.cache import FeatureCache
+from scripts.config import Config
+from scripts.feature import FeatureFactory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KEYS_SCRIPT = """
+from scripts.cache import FeatureCache
+from scripts.config import Config
+from scripts.feature import FeatureFactory
+
+ff = FeatureFactory()
+for name in Config().feature_names:
+    print(name, FeatureCache.get_feature_key(ff(name), "fingerprint"))
+"""
+
+
+def _get_keys_in_new_process():
+    output = subprocess.run(
+        [sys.executable, "-c", KEYS_SCRIPT],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return dict(line.split() for line in output.splitlines())
+
+
+def test_feature_key_is_stable_across_processes():
+    keys = _get_keys_in_new_process()
+    assert keys == _get_keys_in_new_process()
+    assert len(keys) == len(Config().feature_names)
+
+
+def test_feature_key_changes_with_fingerprint():
+    feature = FeatureFactory()("Atom0DistanceStatistics")
+    key_a = FeatureCache.get_feature_key(feature, "a")
+    key_b = FeatureCache.get_feature_key(feature, "b")
+    assert key_a != key_b
+
+
+def test_tracked_files_are_evicted_least_recently_used_first(tmp_path):
+    paths = []
+    for name in ["old", "new"]:
+        path = tmp_path / f"{name}.bin"
+        path.write_bytes(b"0" * 1000)
+        paths.append(str(path))
+    cache = FeatureCache(str(tmp_path / "cache"), budget=2500)
+    cache.track("old", paths[:1], name="X")
+    # another instance (e.g. of a later stage) shares the manifest
+    FeatureCache(str(tmp_path / "cache"), budget=2500).track("new", paths[1:])
+    cache.touch("old")
+
+    values = pd.DataFrame({"a": np.zeros(10)})
+    cache.put("feature", values, name="feature")
+    assert os.path.isfile(paths[0])
+    assert not os.path.isfile(paths[1])
+    assert cache.get_entry("new") is None
+    assert cache.get_entry("old")["paths"] == paths[:1]
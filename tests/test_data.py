@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import scripts.data
+from scripts.config import Config
+from scripts.data import DatasetCreator
+
+# pairs of molecules 2 and 1 of the csv files, in the order of the files
+PAIRS = [
+    (2, 1, 0, "1JHC"),
+    (2, 2, 0, "1JHC"),
+    (1, 1, 0, "1JHC"),
+    (1, 1, 2, "2JHH"),
+]
+
+
+def _write_csv(data_dir):
+    rng = np.random.RandomState(0)
+    structures = []
+    for i in [1, 2]:
+        coordinates = rng.normal(size=(5, 3))
+        coordinates[0] = 0.0
+        structures.append(
+            pd.DataFrame(
+                {
+                    "molecule_name": f"dsgdb9nsd_{i:06d}",
+                    "atom_index": np.arange(5),
+                    "atom": ["C", "H", "H", "H", "H"],
+                    "x": coordinates[:, 0],
+                    "y": coordinates[:, 1],
+                    "z": coordinates[:, 2],
+                }
+            )
+        )
+    pd.concat(structures).to_csv(data_dir / "structures.csv", index=False)
+    pairs = pd.DataFrame(
+        PAIRS, columns=["molecule_name", "atom_index_0", "atom_index_1", "type"]
+    )
+    pairs["molecule_name"] = [f"dsgdb9nsd_{i:06d}" for i in pairs["molecule_name"]]
+    train = pairs.assign(id=np.arange(len(pairs)), scalar_coupling_constant=1.0)
+    train.to_csv(data_dir / "train.csv", index=False)
+    pairs.assign(id=np.arange(len(pairs)) + len(pairs)).to_csv(
+        data_dir / "test.csv", index=False
+    )
+    pairs.assign(fc=1.0, sd=0.0, pso=0.0, dso=0.0).to_csv(
+        data_dir / "scalar_coupling_contributions.csv", index=False
+    )
+
+
+def _get_config(tmp_path):
+    # every file in one directory
+    config = Config()
+    for name, path in vars(Config()).items():
+        if name.endswith("_path") and name != "submission_path":
+            setattr(config, name, str(tmp_path / os.path.basename(path)))
+    config.pickled_data_dir = str(tmp_path)
+    config.parquet_dir = str(tmp_path)
+    return config
+
+
+def test_preprocessed_and_loaded_dataset_are_the_same(tmp_path, monkeypatch):
+    _write_csv(tmp_path)
+    config = _get_config(tmp_path)
+    monkeypatch.setattr(scripts.data, "Config", lambda: config)
+
+    preprocessed = DatasetCreator().run()
+    loaded = DatasetCreator().run()
+
+    for kind in ["train", "test"]:
+        df = getattr(preprocessed, kind)
+        assert df.index.is_monotonic_increasing
+        pd.testing.assert_frame_equal(df, getattr(loaded, kind))
+        molecules = pq.read_table(
+            getattr(config, f"parquet_{kind}_path"), columns=["molecule_name"]
+        ).column("molecule_name")
+        assert molecules.to_pylist() == [1, 1, 2, 2]
+
+
+def test_preprocessed_pickles_are_not_read_as_raw_data(tmp_path, monkeypatch):
+    _write_csv(tmp_path)
+    config = _get_config(tmp_path)
+    monkeypatch.setattr(scripts.data, "Config", lambda: config)
+    config.storage_format = "pickle"
+    from_pickle = DatasetCreator().run()
+
+    config.storage_format = "parquet"
+    from_csv = DatasetCreator().run()
+    pd.testing.assert_frame_equal(from_pickle.train, from_csv.train)
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from scripts.config import Config
+from scripts.db import LocalFile
+from scripts.schema import TEST_SCHEMA, get_read_dtypes, apply_schema
+
+CSV = """id,molecule_name,atom_index_0,atom_index_1,type
+0,dsgdb9nsd_000001,1,0,1JHC
+1,dsgdb9nsd_000001,1,2,2JHH
+2,dsgdb9nsd_000002,1,0,1JHC
+3,dsgdb9nsd_000002,2,0,1JHC
+4,dsgdb9nsd_000003,1,3,3JHH"""
+
+
+def _read_all(path, nrows=None):
+    df = pd.read_csv(
+        path, usecols=list(TEST_SCHEMA), dtype=get_read_dtypes(TEST_SCHEMA), nrows=nrows
+    )
+    return apply_schema(df, TEST_SCHEMA)
+
+
+@pytest.mark.parametrize("text", [CSV, CSV + "\n"])
+@pytest.mark.parametrize("nrows", [None, 3, 10])
+def test_read_csv_fills_chunks_into_preallocated_arrays(tmp_path, text, nrows):
+    path = tmp_path / "test.csv"
+    path.write_text(text)
+    config = Config()
+    config.chunksize = 2
+    df = LocalFile(config)._read_csv(str(path), TEST_SCHEMA, nrows=nrows)
+    pd.testing.assert_frame_equal(df, _read_all(path, nrows))
+
+
+def test_read_csv_of_header_only(tmp_path):
+    path = tmp_path / "test.csv"
+    path.write_text(CSV.splitlines()[0] + "\n")
+    df = LocalFile(Config())._read_csv(str(path), TEST_SCHEMA)
+    assert len(df) == 0
+    assert list(df.columns) == list(_read_all(path).columns)
+
+
+def test_sort_by_molecule_keeps_order_of_pairs_within_molecules():
+    index = pd.MultiIndex.from_tuples(
+        [(2, 1, 0), (1, 3, 0), (1, 1, 0)],
+        names=["molecule_name", "atom_index_0", "atom_index_1"],
+    )
+    df = pd.DataFrame({"id": [0, 1, 2]}, index=index)
+    assert LocalFile.sort_by_molecule(df)["id"].tolist() == [1, 2, 0]
@@ -0,0 +1,40 @@
+import pandas as pd
+
+import scripts.feature
+from scripts.config import Config
+from scripts.feature import FermiContact
+from scripts.store import PredictionStore
+
+
+def _get_config(tmp_path, monkeypatch):
+    config = Config()
+    config.prediction_store_dir = str(tmp_path / "prediction")
+    config.pickled_feature_dir = str(tmp_path / "feature")
+    monkeypatch.setattr(scripts.feature, "Config", lambda: config)
+    return config
+
+
+def test_predicted_feature_is_not_ready_with_true_values(tmp_path, monkeypatch):
+    _get_config(tmp_path, monkeypatch)
+    train = pd.DataFrame({"fc": [1.0, 2.0]}, index=pd.Index([0, 1], name="id"))
+    assert not FermiContact().is_ready(train, "train")
+    assert not FermiContact().is_ready(train, "test")
+
+
+def test_predicted_feature_reads_stored_predictions_of_kind(tmp_path, monkeypatch):
+    config = _get_config(tmp_path, monkeypatch)
+    index = pd.Index([0, 1, 2], name="id")
+    store = PredictionStore(config.prediction_store_dir, config.experiment_name)
+    store.put(
+        "fc",
+        {
+            "train": pd.DataFrame({"fc": [1.5, 2.5, 3.5]}, index=index),
+            "test": pd.DataFrame({"fc": [9.0, 9.0, 9.0]}, index=index),
+        },
+    )
+    # a copy of some rows of train, with the true values
+    train = pd.DataFrame({"fc": [3.0, 1.0]}, index=pd.Index([2, 0], name="id"))
+    feature = FermiContact()
+    assert feature.is_ready(train, "train")
+    values = feature.extract(train, None, "train")
+    assert values.tolist() == [3.5, 1.5]
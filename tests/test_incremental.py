@@ -0,0 +1,136 @@
+import os
+import re
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+from scripts.incremental import get_molecule_digest, get_reusable_molecules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# featurizes the test table of the first n molecules in a new process
+MAKE_X_SCRIPT = """
+import sys
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from scripts.config import Config
+from scripts.dataproc import DataProcessor
+from scripts.preprocess import Preprocessor
+from scripts.schema import ATOM_VOCAB, TYPE_VOCAB
+
+Dataset = namedtuple("Dataset", ["train", "test", "structures", "bonds"])
+tmp_dir, n_molecules, order, out_path = sys.argv[1:]
+
+rng = np.random.RandomState(0)
+structures = []
+test = []
+for i in range(int(n_molecules)):
+    coordinates = rng.normal(scale=1.0, size=(5, 3))
+    coordinates[0] = 0.0
+    structures.append(
+        pd.DataFrame(
+            {
+                "molecule_name": np.full(5, i, dtype=np.int32),
+                "atom_index": np.arange(5, dtype=np.int16),
+                "atom": ATOM_VOCAB.encode(["C", "H", "H", "H", "H"]),
+                "x": coordinates[:, 0].astype(np.float32),
+                "y": coordinates[:, 1].astype(np.float32),
+                "z": coordinates[:, 2].astype(np.float32),
+            }
+        )
+    )
+    test.append(
+        pd.DataFrame(
+            {
+                "id": np.arange(4 * i, 4 * i + 4, dtype=np.int32),
+                "molecule_name": np.full(4, i, dtype=np.int32),
+                "atom_index_0": np.array([1, 2, 1, 3], np.int16),
+                "atom_index_1": np.array([0, 0, 2, 4], np.int16),
+                "type": TYPE_VOCAB.encode(["1JHC", "1JHC", "2JHH", "2JHH"]),
+            }
+        )
+    )
+preprocessor = Preprocessor()
+structures, bonds = preprocessor.preprocess_structures(
+    pd.concat(structures, ignore_index=True)
+)
+test = preprocessor.preprocess_test(pd.concat(test, ignore_index=True), structures)
+if order == "reversed":
+    test = test[test.columns[::-1]]
+elif order == "labelled":
+    test = test.assign(scalar_coupling_constant=1.0)
+dataset = Dataset(None, test, structures.set_index("molecule_name"), bonds)
+
+config = Config()
+config.incremental = True
+config.feature_cache_dir = tmp_dir + "/feature_cache"
+config.dtype_schema_path = tmp_dir + "/dtype_schema.json"
+config.save_X = False
+config.memmap_X = False
+DataProcessor(config)._make_X(test, dataset, "test").to_pickle(out_path)
+"""
+
+
+def _make_X_in_new_process(tmp_path, n_molecules, order, name):
+    out_path = str(tmp_path / f"{name}.pkl")
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            MAKE_X_SCRIPT,
+            str(tmp_path),
+            str(n_molecules),
+            order,
+            out_path,
+        ],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return pd.read_pickle(out_path), output
+
+
+def test_grown_table_reuses_features_of_another_process(tmp_path):
+    # the first table has its columns in another order than the grown one
+    _make_X_in_new_process(tmp_path, 8, "reversed", "old")
+    X, output = _make_X_in_new_process(tmp_path, 10, "default", "new")
+
+    computed = re.findall(r"compute (\d+) features for (\d+) of (\d+) rows", output)
+    assert computed
+    assert all((n_rows, n_total) == ("8", "40") for _, n_rows, n_total in computed)
+
+    (tmp_path / "full").mkdir()
+    expected, _ = _make_X_in_new_process(tmp_path / "full", 10, "default", "full")
+    pd.testing.assert_frame_equal(X, expected)
+
+
+def test_digest_does_not_depend_on_other_columns():
+    index = pd.MultiIndex.from_arrays(
+        [[0, 0, 1], [1, 2, 1]], names=["molecule_name", "atom_index_0"]
+    )
+    df = pd.DataFrame(
+        {"dist": [1.0, 2.0, 3.0], "type": [0, 1, 0]}, index=index
+    ).reset_index(level=0, drop=False)
+    digest = get_molecule_digest(df)
+    changed = df.assign(type=[0, 1, 1])[["type", "molecule_name", "dist"]]
+    new_digest = get_molecule_digest(changed)
+
+    assert get_reusable_molecules(digest, new_digest, ["dist"]).tolist() == [0, 1]
+    assert get_reusable_molecules(digest, new_digest, ["type"]).tolist() == [0]
+    assert get_reusable_molecules(digest[["_index"]], new_digest, ["dist"]) is None
+    assert np.array_equal(digest["dist"].values, new_digest["dist"].values)
+
+
+def test_other_columns_do_not_invalidate_features(tmp_path):
+    X, output = _make_X_in_new_process(tmp_path, 4, "default", "old")
+    assert "save MoleculeDistance feature" in output
+
+    labelled, output = _make_X_in_new_process(tmp_path, 4, "labelled", "new")
+    assert "save" not in output
+    pd.testing.assert_frame_equal(labelled, X)
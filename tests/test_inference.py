@@ -0,0 +1,26 @@
+import lightgbm
+import numpy as np
+import pandas as pd
+
+from scripts.inference import FoldEnsemblePredictor
+from scripts.matrix import MemmapMatrix
+
+
+def test_predict_rows_of_memory_mapped_x_in_batches(tmp_path):
+    rng = np.random.RandomState(0)
+    memmap = MemmapMatrix(str(tmp_path / "X"))
+    array = memmap.create((300, 3), np.float32)
+    array[:] = rng.normal(size=(300, 3))
+    array.flush()
+    memmap.save_manifest(pd.RangeIndex(300), ["a", "b", "c"], np.float32)
+    X = memmap.load()
+    booster = lightgbm.train(
+        {"verbose": -1},
+        lightgbm.Dataset(X, label=X["a"] + X["b"]),
+        num_boost_round=5,
+    )
+
+    rows = np.sort(rng.choice(300, size=70, replace=False))
+    predictor = FoldEnsemblePredictor([booster, booster], batch_size=16)
+    y_pred = predictor.predict(X, rows=rows)
+    assert np.allclose(y_pred, booster.predict(X.iloc[rows]))
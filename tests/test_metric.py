@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from scripts.metric import calculate_score, group_log_mae
+
+
+def test_group_log_mae_is_mean_of_log_mae_per_type():
+    y_true = np.array([1.0, 2.0, 3.0, 5.0])
+    y_pred = np.array([2.0, 2.0, 3.0, 3.0])
+    types = np.array([0, 0, 1, 1])
+    expected = np.mean([np.log(0.5), np.log(1.0)])
+    assert np.isclose(group_log_mae(y_true, y_pred, types), expected)
+
+
+def test_calculate_score_uses_the_given_target():
+    y_valid = pd.DataFrame(
+        {
+            "type": [0, 0, 1, 1],
+            "fc": [1.0, 2.0, 3.0, 4.0],
+            "sd": [1000.0, 2000.0, 3000.0, 4000.0],
+        }
+    )
+    y_pred = y_valid["sd"].values + 1.0
+    assert np.isclose(calculate_score(y_valid, y_pred, "sd"), 0.0)
+    assert calculate_score(y_valid, y_pred, "fc") > 0.0
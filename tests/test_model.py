@@ -0,0 +1,22 @@
+import lightgbm
+import numpy as np
+import pandas as pd
+
+from scripts.model import BinnedDataset
+
+
+def test_binned_dataset_subsets_do_not_copy_x():
+    rng = np.random.RandomState(0)
+    X = pd.DataFrame(rng.normal(size=(600, 3)), columns=["a", "b", "c"])
+    y = X["a"] + rng.normal(scale=0.1, size=len(X))
+    binned = BinnedDataset(X, y)
+    assert binned.dataset.data is None
+
+    train_set = binned.subset(np.arange(500))
+    valid_set = binned.subset(np.arange(500, 600))
+    booster = lightgbm.train(
+        {"verbose": -1}, train_set, num_boost_round=5, valid_sets=[valid_set]
+    )
+    assert train_set.data is None
+    assert valid_set.data is None
+    assert booster.predict(X.iloc[500:]).shape == (100,)
@@ -0,0 +1,62 @@
+import lightgbm
+import numpy as np
+import pytest
+
+from scripts.config import Config
+from scripts.registry import ModelRegistry
+from scripts.service import MoleculeScorer, PROBE_MOLECULE
+
+ETHANE = {
+    "atoms": ["C", "C", "H", "H", "H", "H", "H", "H"],
+    "coordinates": [
+        [0.0, 0.0, 0.765],
+        [0.0, 0.0, -0.765],
+        [1.018, 0.0, 1.164],
+        [-0.509, 0.882, 1.164],
+        [-0.509, -0.882, 1.164],
+        [-1.018, 0.0, -1.164],
+        [0.509, -0.882, -1.164],
+        [0.509, 0.882, -1.164],
+    ],
+    "pairs": [[2, 0, "1JHC"], [2, 1, "2JHC"], [2, 5, "3JHH"]],
+}
+
+
+def _get_config(tmp_path):
+    config = Config()
+    config.model_registry_dir = str(tmp_path / "model")
+    config.dtype_schema_path = str(tmp_path / "dtype_schema.json")
+    config.n_predict_workers = 1
+    return config
+
+
+def _register_model(config, scorer):
+    test, dataset = scorer._preprocess([PROBE_MOLECULE, ETHANE] * 10)
+    X = scorer._make_X(test, dataset)
+    y = np.random.RandomState(0).normal(size=len(X))
+    booster = lightgbm.train(
+        {"verbose": -1, "min_data_in_leaf": 1},
+        lightgbm.Dataset(X, label=y),
+        num_boost_round=5,
+    )
+    registry = ModelRegistry(config.model_registry_dir, config.experiment_name)
+    registry.save(config.target_name, [booster], X.columns, {}, [0.0])
+    return booster, X
+
+
+def test_scorer_predicts_each_pair_of_each_molecule(tmp_path):
+    config = _get_config(tmp_path)
+    booster, X = _register_model(config, MoleculeScorer(config))
+
+    scorer = MoleculeScorer(config)
+    predictions = scorer.score([PROBE_MOLECULE, ETHANE])
+
+    assert [len(p) for p in predictions] == [2, 3]
+    expected = booster.predict(X.iloc[:5])
+    assert np.allclose(np.concatenate(predictions), expected)
+
+
+def test_check_rejects_unknown_types():
+    molecule = dict(PROBE_MOLECULE, pairs=[[1, 0, "9JHX"]])
+    with pytest.raises(ValueError):
+        MoleculeScorer.check(molecule)
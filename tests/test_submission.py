@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+
+import scripts.submission
+from scripts.config import Config
+from scripts.submission import Submission
+
+
+def _get_config(tmp_path):
+    config = Config()
+    config.sample_submission_path = str(tmp_path / "sample_submission.csv")
+    config.submission_path = str(tmp_path / "submission.csv")
+    pd.DataFrame({"id": [10, 11, 12], "scalar_coupling_constant": 0.0}).to_csv(
+        config.sample_submission_path, index=False
+    )
+    return config
+
+
+def test_submission_matches_predictions_by_id(tmp_path, monkeypatch):
+    config = _get_config(tmp_path)
+    monkeypatch.setattr(scripts.submission, "Config", lambda: config)
+    Submission().save([2.0, 0.0, 1.0], ids=[12, 10, 11])
+    submission = pd.read_csv(config.submission_path)
+    assert submission["scalar_coupling_constant"].tolist() == [0.0, 1.0, 2.0]
+
+
+def test_submission_requires_every_id(tmp_path, monkeypatch):
+    config = _get_config(tmp_path)
+    monkeypatch.setattr(scripts.submission, "Config", lambda: config)
+    with pytest.raises(ValueError):
+        Submission().save([0.0, 1.0], ids=[10, 11])
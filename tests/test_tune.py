@@ -0,0 +1,31 @@
+import pickle
+
+import pytest
+
+from scripts.config import Config
+from scripts.tune import get_pruner, ParameterTuning
+
+
+@pytest.mark.parametrize("pruner", ["median", "successive_halving", "hyperband", None])
+def test_default_pruner_params_fit_each_pruner(pruner):
+    config = Config()
+    config.pruner = pruner
+    tuning = ParameterTuning(config)
+    get_pruner(tuning.pruner, **tuning.pruner_params)
+
+
+def test_budget_follows_fields_set_after_construction():
+    config = Config()
+    config.n_cores = 8
+    config.n_trial_workers = 2
+    config.trial_backend = "process"
+    assert config.budget.trial_threads == 4
+    assert config.budget.backend == "process"
+    assert ParameterTuning(config).budget.n_trial_workers == 2
+
+
+def test_spawned_tuning_workers_can_be_pickled():
+    # spawned workers get the tuning and its inputs by pickling them
+    config = Config()
+    config.trial_backend = "process"
+    pickle.dumps(ParameterTuning(config)._optimize_worker)
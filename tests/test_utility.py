@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from scripts.utility import reduce_mem_usage, DtypeSchemaStore
+
+
+def test_reduce_mem_usage_reuses_stored_schema(tmp_path):
+    store = DtypeSchemaStore(str(tmp_path / "dtype_schema.json"))
+    df = pd.DataFrame({"count": [1, 2, 3], "mean": [0.5, 1.5, 2.5]})
+    reduced = reduce_mem_usage(df, "feature", verbose=False, store=store)
+    assert reduced["count"].dtype == np.int8
+    assert reduced["mean"].dtype == np.float32
+    assert store.get("feature") == {"count": "int8", "mean": "float32"}
+
+
+def test_reduce_mem_usage_widens_overflowing_int(tmp_path):
+    store = DtypeSchemaStore(str(tmp_path / "dtype_schema.json"))
+    reduce_mem_usage(pd.DataFrame({"count": [1, 2, 3]}), "feature", False, store=store)
+
+    df = pd.DataFrame({"count": [10, 200, 300]})
+    reduced = reduce_mem_usage(df, "feature", verbose=False, store=store)
+    assert reduced["count"].tolist() == [10, 200, 300]
+    assert store.get("feature") == {"count": "int16"}
+
+    # the widened schema still fits the first table
+    reduced = reduce_mem_usage(
+        pd.DataFrame({"count": [1, 2, 3]}), "feature", False, store=store
+    )
+    assert reduced["count"].dtype == np.int16
+
+
+def test_reduce_mem_usage_widens_overflowing_float16(tmp_path):
+    store = DtypeSchemaStore(str(tmp_path / "dtype_schema.json"))
+    df = pd.DataFrame({"dist": [0.5, 1.5]})
+    reduce_mem_usage(df, "feature", False, float_policy="float16", store=store)
+
+    df = pd.DataFrame({"dist": [0.5, 1e6]})
+    reduced = reduce_mem_usage(
+        df, "feature", False, float_policy="float16", store=store
+    )
+    assert np.isfinite(reduced["dist"]).all()
+    assert store.get("feature") == {"dist": "float32"}
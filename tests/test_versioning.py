@@ -0,0 +1,35 @@
+import os
+
+import pandas as pd
+
+from scripts.store import PredictionStore
+from scripts.versioning import VersionedDir
+
+
+def test_versioned_dir_adds_complete_versions(tmp_path):
+    versions = VersionedDir(str(tmp_path / "target"))
+    assert versions.get_version() is None
+
+    def write(tmp_dir, version):
+        with open(os.path.join(tmp_dir, "values.txt"), "w") as f:
+            f.write(str(version))
+        return {"n": version}
+
+    assert versions.add(write) == 1
+    assert versions.add(write) == 2
+    assert versions.get_version() == 2
+    assert versions.get_version(3) is None
+    assert versions.get_entry(1) == {"n": 1}
+    assert sorted(os.listdir(tmp_path / "target")) == ["manifest.json", "v1", "v2"]
+
+
+def test_prediction_store_keeps_versions(tmp_path):
+    store = PredictionStore(str(tmp_path), "baseline")
+    index = pd.Index([3, 4], name="id")
+    for value in [1.0, 2.0]:
+        store.put("fc", {"test": pd.DataFrame({"fc": [value] * 2}, index=index)})
+
+    assert store.get("fc", "test")["fc"].tolist() == [2.0, 2.0]
+    assert store.get("fc", "test", version=1)["fc"].tolist() == [1.0, 1.0]
+    assert store.get("fc", "test").index.equals(index)
+    assert not store.has("fc", "train")